@@ -1,5 +1,18 @@
 import anthropic
-from typing import List, Optional, Dict, Any
+import asyncio
+import httpx
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+class RoundBreak(str):
+    """Separator stream_response yields between the text of two tool rounds"""
+
+
+# Text before the last break is narration from tool rounds; the answer is
+# what follows it, matching what generate_response returns
+ROUND_BREAK = RoundBreak("\n\n")
 
 
 class AIGenerator:
@@ -41,14 +54,43 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
 
-    def __init__(self, api_key: str, model: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    # Prompt-cache breakpoint; tools and system prompt form the cached prefix.
+    # The API only caches prefixes of at least 1024 tokens on Sonnet models
+    # and silently ignores the marker below that. Today's tools plus system
+    # prompt are ~2.9K characters (~730 tokens), so caching stays off until
+    # the prefix grows past the minimum; the markers make it apply then.
+    CACHE_CONTROL = {"type": "ephemeral"}
+    SYSTEM_BLOCK = {
+        "type": "text",
+        "text": SYSTEM_PROMPT,
+        "cache_control": CACHE_CONTROL,
+    }
+
+    # Maximum number of sequential tool rounds per query
+    MAX_TOOL_ROUNDS = 2
+
+    def __init__(self, api_key: str, model: str, max_workers: int = 4):
+        # Async client over a pooled connection so requests never block the
+        # event loop and reuse keep-alive connections across queries
+        self.client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            ),
+        )
         self.model = model
+        self.max_workers = max_workers  # Max tool calls executed concurrently
+
+        # Tools are synchronous (ChromaDB), so they run on a shared thread pool
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
 
         # Pre-build base API parameters
         self.base_params = {"model": self.model, "temperature": 0, "max_tokens": 800}
 
-    def generate_response(
+        # Pre-build system content for the common no-history case
+        self._system_no_history = [self.SYSTEM_BLOCK]
+
+    async def generate_response(
         self,
         query: str,
         conversation_history: Optional[str] = None,
@@ -67,13 +109,104 @@ Provide only the direct answer to what was asked.
         Returns:
             Generated response as string
         """
+        api_params = self._build_params(query, conversation_history, tools)
 
-        # Build system content efficiently - avoid string ops when possible
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
-            if conversation_history
-            else self.SYSTEM_PROMPT
-        )
+        # Get response from Claude
+        response = await self.client.messages.create(**api_params)
+
+        # Handle tool execution if needed
+        if response.stop_reason == "tool_use" and tool_manager:
+            return await self._handle_tool_execution(response, api_params, tool_manager)
+
+        # Return direct response
+        return response.content[0].text
+
+    async def stream_response(
+        self,
+        query: str,
+        conversation_history: Optional[str] = None,
+        tools: Optional[List] = None,
+        tool_manager=None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the response text as Claude generates it.
+
+        Each tool_use block is dispatched to the thread pool as soon as its
+        input JSON is complete, so tools run while the rest of the message is
+        still streaming. Tool rounds follow the same limits as
+        generate_response.
+
+        Args:
+            query: The user's question or request
+            conversation_history: Previous messages for context
+            tools: Available tools the AI can use
+            tool_manager: Manager to execute tools
+
+        Yields:
+            Chunks of response text, with ROUND_BREAK between tool rounds
+        """
+        api_params = self._build_params(query, conversation_history, tools)
+        messages = api_params["messages"]
+        params = api_params
+        round_count = 0
+        final_round = False
+
+        while True:
+            pending = {}
+            tool_uses = []
+            emitted_text = False
+
+            async with self.client.messages.stream(**params) as stream:
+                async for event in stream:
+                    if event.type == "text":
+                        emitted_text = True
+                        yield event.text
+                    elif (
+                        event.type == "content_block_stop"
+                        and event.content_block.type == "tool_use"
+                        and tool_manager
+                    ):
+                        # Input is complete once its block stops, start it now
+                        tool_uses.append(event.content_block)
+                        self._dispatch_tool(pending, event.content_block, tool_manager)
+                response = await stream.get_final_message()
+
+            if final_round or response.stop_reason != "tool_use" or not tool_uses:
+                break
+
+            round_count += 1
+            messages.append({"role": "assistant", "content": response.content})
+            tool_results = await self._gather_tool_results(pending, tool_uses)
+            messages.append({"role": "user", "content": tool_results})
+
+            final_round = round_count == self.MAX_TOOL_ROUNDS or any(
+                result.get("is_error") for result in tool_results
+            )
+            params = self._follow_up_params(api_params, final_round)
+
+            # Keep text from separate rounds from running together
+            if emitted_text:
+                yield ROUND_BREAK
+
+    def _build_params(
+        self,
+        query: str,
+        conversation_history: Optional[str],
+        tools: Optional[List],
+    ) -> Dict[str, Any]:
+        """Build the initial API parameters for a query."""
+        # Static prompt block carries the cache marker; history goes in its
+        # own unmarked block so it never changes the cacheable prefix
+        if conversation_history:
+            system_content = [
+                self.SYSTEM_BLOCK,
+                {
+                    "type": "text",
+                    "text": "".join(("Previous conversation:\n", conversation_history)),
+                },
+            ]
+        else:
+            system_content = self._system_no_history
 
         # Prepare API call parameters efficiently
         api_params = {
@@ -84,94 +217,148 @@ Provide only the direct answer to what was asked.
 
         # Add tools if available
         if tools:
-            api_params["tools"] = tools
+            api_params["tools"] = self._cacheable_tools(tools)
             api_params["tool_choice"] = {"type": "auto"}
 
-        # Get response from Claude
-        response = self.client.messages.create(**api_params)
+        return api_params
 
-        # Handle tool execution if needed
-        if response.stop_reason == "tool_use" and tool_manager:
-            return self._handle_tool_execution(response, api_params, tool_manager)
-
-        # Return direct response
-        return response.content[0].text
-
-    def _handle_tool_execution(
+    async def _handle_tool_execution(
         self, initial_response, base_params: Dict[str, Any], tool_manager
     ):
         """
         Handle execution of tool calls with support for sequential tool calling.
 
-        Supports up to MAX_ROUNDS of sequential tool calls, allowing Claude to
+        Supports up to MAX_TOOL_ROUNDS of sequential tool calls, allowing Claude to
         chain multiple tools (e.g., get_course_outline then search_course_content).
 
         Args:
             initial_response: The response containing tool use requests
-            base_params: Base API parameters
+            base_params: Initial API parameters, reused for follow-up calls
+                (its messages list is extended in place)
             tool_manager: Manager to execute tools
 
         Returns:
             Final response text after tool execution
         """
-        MAX_ROUNDS = 2
-        messages = base_params["messages"].copy()
+        messages = base_params["messages"]
         current_response = initial_response
         round_count = 0
 
-        while round_count < MAX_ROUNDS:
+        while round_count < self.MAX_TOOL_ROUNDS:
             round_count += 1
 
+            # Single pass over the content drives dispatch and id correlation
+            tool_uses = [
+                block for block in current_response.content if block.type == "tool_use"
+            ]
+            if not tool_uses:
+                break  # Nothing to execute, treat as end of turn
+
             # Add Claude's tool_use response to conversation
             messages.append({"role": "assistant", "content": current_response.content})
 
-            # Execute all tool calls, collect results
-            tool_results = []
-            execution_failed = False
-            for block in current_response.content:
-                if block.type == "tool_use":
-                    try:
-                        result = tool_manager.execute_tool(block.name, **block.input)
-                        tool_results.append(
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": block.id,
-                                "content": result,
-                            }
-                        )
-                    except Exception as e:
-                        tool_results.append(
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": block.id,
-                                "content": f"Error: {str(e)}",
-                                "is_error": True,
-                            }
-                        )
-                        execution_failed = True
+            # Execute all tool calls concurrently, results keep block order
+            tool_results = await self._execute_tools(tool_uses, tool_manager)
+            execution_failed = any(result.get("is_error") for result in tool_results)
 
             # Add tool results to conversation
             messages.append({"role": "user", "content": tool_results})
 
-            # API call WITH tools (allows sequential tool calling)
-            next_params = {
-                **self.base_params,
-                "messages": messages,
-                "system": base_params["system"],
-                "tools": base_params.get("tools"),
-                "tool_choice": {"type": "auto"},
-            }
-            current_response = self.client.messages.create(**next_params)
+            # Last call if the round limit is reached or a tool failed
+            final_round = round_count == self.MAX_TOOL_ROUNDS or execution_failed
+
+            current_response = await self.client.messages.create(
+                **self._follow_up_params(base_params, final_round)
+            )
 
             # Check termination conditions
             if current_response.stop_reason != "tool_use":
                 break  # Claude is done with tools
-            if execution_failed:
-                break  # Tool error, let Claude respond with error context
+            if final_round:
+                break  # No more tool rounds, let Claude's answer stand
 
         # Extract and return final text
         return self._extract_text_response(current_response)
 
+    def _follow_up_params(
+        self, base_params: Dict[str, Any], final_round: bool
+    ) -> Dict[str, Any]:
+        """
+        Parameters for the call that follows a round of tool results.
+
+        Tools stay defined (allowing sequential tool calling) and the system
+        and tools blocks are reused unchanged, so follow-ups share the
+        cache-marked prefix (see CACHE_CONTROL for when it is cached).
+        On the final call tools remain defined, as the API requires alongside
+        tool_use history, but tool_choice "none" forces a text answer.
+        """
+        if final_round and "tools" in base_params:
+            return {**base_params, "tool_choice": {"type": "none"}}
+        return base_params
+
+    def _cacheable_tools(self, tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return a copy of tools with a cache breakpoint on the last definition."""
+        return [*tools[:-1], {**tools[-1], "cache_control": self.CACHE_CONTROL}]
+
+    async def _execute_tools(
+        self, tool_uses: List, tool_manager
+    ) -> List[Dict[str, Any]]:
+        """
+        Execute tool_use blocks in parallel, preserving their original order.
+
+        Each tool call is an independent I/O-bound lookup, so running them on
+        the thread pool bounds the round's latency by the slowest call.
+        Identical calls (same tool name and input) are executed only once and
+        their result is shared by every tool_use id that requested it.
+
+        Args:
+            tool_uses: The tool_use content blocks from Claude's response
+            tool_manager: Manager to execute tools
+
+        Returns:
+            List of tool_result blocks, one per tool_use block
+        """
+        pending = {}
+        for block in tool_uses:
+            self._dispatch_tool(pending, block, tool_manager)
+        return await self._gather_tool_results(pending, tool_uses)
+
+    @staticmethod
+    def _call_key(block) -> Tuple[str, str]:
+        """Identify a tool call by its name and canonicalized input."""
+        return block.name, json.dumps(block.input, sort_keys=True)
+
+    def _dispatch_tool(self, pending: Dict, block, tool_manager):
+        """Schedule a tool_use block on the thread pool unless already pending."""
+        key = self._call_key(block)
+        if key not in pending:
+            pending[key] = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._execute_tool, block, tool_manager
+            )
+
+    async def _gather_tool_results(
+        self, pending: Dict, tool_uses: List
+    ) -> List[Dict[str, Any]]:
+        """Await pending calls and fan shared results out to each tool_use id."""
+        results = dict(zip(pending, await asyncio.gather(*pending.values())))
+        return [
+            {**results[self._call_key(block)], "tool_use_id": block.id}
+            for block in tool_uses
+        ]
+
+    def _execute_tool(self, block, tool_manager) -> Dict[str, Any]:
+        """Execute a single tool_use block and wrap the outcome as a tool_result."""
+        try:
+            result = tool_manager.execute_tool(block.name, **block.input)
+            return {"type": "tool_result", "tool_use_id": block.id, "content": result}
+        except Exception as e:
+            return {
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": f"Error: {str(e)}",
+                "is_error": True,
+            }
+
     def _extract_text_response(self, response) -> str:
         """Extract text content from a Claude response."""
         for block in response.content:
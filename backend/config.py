@@ -23,6 +23,10 @@ class Config:
     MAX_RESULTS: int = 5  # Maximum search results to return
     MAX_HISTORY: int = 2  # Number of conversation messages to remember
 
+    # Semantic response cache settings
+    RESPONSE_CACHE_SIZE: int = 500  # Maximum cached answers kept (LRU eviction)
+    RESPONSE_CACHE_THRESHOLD: float = 0.05  # Max cosine distance for a cache hit
+
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
 
@@ -1,10 +1,14 @@
-from typing import List, Tuple, Optional, Dict
+from typing import AsyncIterator, List, Tuple, Optional, Dict
+import asyncio
+import hashlib
+import json
 import os
 from document_processor import DocumentProcessor
 from vector_store import VectorStore
-from ai_generator import AIGenerator
+from ai_generator import AIGenerator, RoundBreak
 from session_manager import SessionManager
-from search_tools import ToolManager, CourseSearchTool, CourseOutlineTool
+from semantic_cache import SemanticCache
+from search_tools import ToolManager, CourseSearchTool, CourseOutlineTool, RequestTools
 from models import Course, Lesson, CourseChunk
 
 
@@ -33,6 +37,15 @@ class RAGSystem:
         self.tool_manager.register_tool(self.search_tool)
         self.tool_manager.register_tool(self.outline_tool)
 
+        # The cache persists across restarts, so entries are versioned by
+        # everything besides course content that shapes an answer
+        self.response_cache = SemanticCache(
+            self.vector_store,
+            config.RESPONSE_CACHE_SIZE,
+            config.RESPONSE_CACHE_THRESHOLD,
+            self._answer_version(),
+        )
+
     def add_course_document(self, file_path: str) -> Tuple[Course, int]:
         """
         Add a single course document to the knowledge base.
@@ -55,6 +68,9 @@ class RAGSystem:
             # Add course content chunks to vector store
             self.vector_store.add_course_content(course_chunks)
 
+            # Cached answers and lookups may be outdated by the new content
+            self._invalidate_caches()
+
             return course, len(course_chunks)
         except Exception as e:
             print(f"Error processing course document {file_path}: {e}")
@@ -80,6 +96,7 @@ class RAGSystem:
         if clear_existing:
             print("Clearing existing data for fresh rebuild...")
             self.vector_store.clear_all_data()
+            self._invalidate_caches()
 
         if not os.path.exists(folder_path):
             print(f"Folder {folder_path} does not exist")
@@ -116,9 +133,29 @@ class RAGSystem:
                 except Exception as e:
                     print(f"Error processing {file_name}: {e}")
 
+        # Cached answers and lookups may be outdated by newly added courses
+        if total_courses:
+            self._invalidate_caches()
+
         return total_courses, total_chunks
 
-    def query(
+    def _answer_version(self) -> str:
+        """Fingerprint of the model, system prompt and tool definitions"""
+        fingerprint = "\0".join(
+            (
+                self.config.ANTHROPIC_MODEL,
+                self.ai_generator.SYSTEM_PROMPT,
+                json.dumps(self.tool_manager.get_tool_definitions(), sort_keys=True),
+            )
+        )
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:16]
+
+    def _invalidate_caches(self):
+        """Drop cached answers and course lookups after the catalog changes"""
+        self.response_cache.clear()
+        self.outline_tool.clear_cache()
+
+    async def query(
         self, query: str, session_id: Optional[str] = None
     ) -> Tuple[str, List[str]]:
         """
@@ -131,6 +168,85 @@ class RAGSystem:
         Returns:
             Tuple of (response, sources list - empty for tool-based approach)
         """
+        prompt, history, cached = await self._prepare_query(query, session_id)
+        if cached:
+            return cached
+
+        # Generate response using AI with tools; sources stay with this query
+        request_tools = self.tool_manager.for_request()
+        response = await self.ai_generator.generate_response(
+            query=prompt,
+            conversation_history=history,
+            tools=request_tools.get_tool_definitions(),
+            tool_manager=request_tools,
+        )
+
+        sources = await self._complete_query(
+            query, response, request_tools, history, session_id
+        )
+
+        # Return response with sources from tool searches
+        return response, sources
+
+    async def query_stream(
+        self, query: str, session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        Process a user query, streaming the answer as it is generated.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Yields:
+            {"type": "text", "text": ...} events with answer chunks, followed
+            by one {"type": "sources", "sources": [...]} event
+        """
+        prompt, history, cached = await self._prepare_query(query, session_id)
+
+        # A cached answer is sent as a single chunk
+        if cached:
+            response, sources = cached
+            yield {"type": "text", "text": response}
+            yield {"type": "sources", "sources": sources}
+            return
+
+        chunks = []
+        request_tools = self.tool_manager.for_request()
+        stream = self.ai_generator.stream_response(
+            query=prompt,
+            conversation_history=history,
+            tools=request_tools.get_tool_definitions(),
+            tool_manager=request_tools,
+        )
+        try:
+            async for text in stream:
+                if isinstance(text, RoundBreak):
+                    # Cache and record only the final round, as query() does
+                    chunks.clear()
+                else:
+                    chunks.append(text)
+                yield {"type": "text", "text": text}
+        finally:
+            # Close Claude's stream right away if the client disconnects
+            await stream.aclose()
+
+        response = "".join(chunks)
+        sources = await self._complete_query(
+            query, response, request_tools, history, session_id
+        )
+        yield {"type": "sources", "sources": sources}
+
+    async def _prepare_query(
+        self, query: str, session_id: Optional[str]
+    ) -> Tuple[str, Optional[str], Optional[Tuple[str, List[Dict]]]]:
+        """
+        Build the prompt, load the session history and consult the cache.
+
+        Returns:
+            Tuple of (prompt, history, cached) where cached is (response,
+            sources) on a cache hit, already recorded in the session
+        """
         # Create prompt for the AI with clear instructions
         prompt = f"""Answer this question about course materials: {query}"""
 
@@ -139,26 +255,35 @@ class RAGSystem:
         if session_id:
             history = self.session_manager.get_conversation_history(session_id)
 
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
-            query=prompt,
-            conversation_history=history,
-            tools=self.tool_manager.get_tool_definitions(),
-            tool_manager=self.tool_manager,
-        )
+        # Standalone questions can be answered from the semantic response cache
+        cached = None
+        if not history:
+            cached = await asyncio.to_thread(self.response_cache.lookup, query)
+            if cached and session_id:
+                self.session_manager.add_exchange(session_id, query, cached[0])
+
+        return prompt, history, cached
 
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
+    async def _complete_query(
+        self,
+        query: str,
+        response: str,
+        request_tools: RequestTools,
+        history: Optional[str],
+        session_id: Optional[str],
+    ) -> List[Dict]:
+        """Collect the query's sources, cache the answer and record the exchange"""
+        sources = request_tools.get_sources()
 
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
+        # Cache standalone answers, unless a tool failed while producing them
+        if not history and not request_tools.failed:
+            await asyncio.to_thread(self.response_cache.store, query, response, sources)
 
         # Update conversation history
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
 
-        # Return response with sources from tool searches
-        return response, sources
+        return sources
 
     def get_course_analytics(self) -> Dict:
         """Get analytics about the course catalog"""
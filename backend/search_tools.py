@@ -1,7 +1,14 @@
-from typing import Dict, Any, Optional, Protocol
+import functools
+import itertools
+from typing import Dict, Any, List, Optional, Protocol, Tuple
 from abc import ABC, abstractmethod
 from vector_store import VectorStore, SearchResults
 
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional; the stdlib parser is a drop-in fallback
+    from json import loads as json_loads
+
 
 class Tool(ABC):
     """Abstract base class for all tools"""
@@ -16,38 +23,49 @@ class Tool(ABC):
         """Execute the tool with given parameters"""
         pass
 
+    def run(self, **kwargs) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Execute the tool and return (result, sources) for this call alone.
+
+        Tools that produce sources override this; sources are returned per
+        call rather than kept on the instance, which queries share.
+        """
+        return self.execute(**kwargs), []
+
 
 class CourseSearchTool(Tool):
     """Tool for searching course content with semantic course name matching"""
 
+    # Static Anthropic tool definition, shared by every call
+    _DEFINITION = {
+        "name": "search_course_content",
+        "description": "Search course materials with smart course name matching and lesson filtering",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "What to search for in the course content",
+                },
+                "course_name": {
+                    "type": "string",
+                    "description": "Course title (partial matches work, e.g. 'MCP', 'Introduction')",
+                },
+                "lesson_number": {
+                    "type": "integer",
+                    "description": "Specific lesson number to search within (e.g. 1, 2, 3)",
+                },
+            },
+            "required": ["query"],
+        },
+    }
+
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
-        self.last_sources = []  # Track sources from last search
 
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
-        return {
-            "name": "search_course_content",
-            "description": "Search course materials with smart course name matching and lesson filtering",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "What to search for in the course content",
-                    },
-                    "course_name": {
-                        "type": "string",
-                        "description": "Course title (partial matches work, e.g. 'MCP', 'Introduction')",
-                    },
-                    "lesson_number": {
-                        "type": "integer",
-                        "description": "Specific lesson number to search within (e.g. 1, 2, 3)",
-                    },
-                },
-                "required": ["query"],
-            },
-        }
+        return self._DEFINITION
 
     def execute(
         self,
@@ -66,7 +84,18 @@ class CourseSearchTool(Tool):
         Returns:
             Formatted search results or error message
         """
+        result, _ = self.run(
+            query=query, course_name=course_name, lesson_number=lesson_number
+        )
+        return result
 
+    def run(
+        self,
+        query: str,
+        course_name: Optional[str] = None,
+        lesson_number: Optional[int] = None,
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """Search and return (result, sources) for this call"""
         # Use the vector store's unified search interface
         results = self.store.search(
             query=query, course_name=course_name, lesson_number=lesson_number
@@ -74,7 +103,7 @@ class CourseSearchTool(Tool):
 
         # Handle errors
         if results.error:
-            return results.error
+            return results.error, []
 
         # Handle empty results
         if results.is_empty():
@@ -83,70 +112,78 @@ class CourseSearchTool(Tool):
                 filter_info += f" in course '{course_name}'"
             if lesson_number:
                 filter_info += f" in lesson {lesson_number}"
-            return f"No relevant content found{filter_info}."
+            return f"No relevant content found{filter_info}.", []
 
         # Format and return results
         return self._format_results(results)
 
-    def _format_results(self, results: SearchResults) -> str:
-        """Format search results with course and lesson context"""
+    def _format_results(
+        self, results: SearchResults
+    ) -> Tuple[str, List[Dict[str, Any]]]:
+        """Format search results with course and lesson context, plus sources"""
         formatted = []
         sources = []  # Track sources for the UI
+        link_cache: Dict[Tuple[str, int], Optional[str]] = {}  # One lookup per lesson
 
         for doc, meta in zip(results.documents, results.metadata):
             course_title = meta.get("course_title", "unknown")
             lesson_num = meta.get("lesson_number")
 
-            # Build context header
-            header = f"[{course_title}"
-            if lesson_num is not None:
-                header += f" - Lesson {lesson_num}"
-            header += "]"
-
-            # Build source text for the UI
-            source_text = course_title
-            if lesson_num is not None:
-                source_text += f" - Lesson {lesson_num}"
+            if lesson_num is None:
+                source_text = course_title
+                link = None
+            else:
+                source_text = f"{course_title} - Lesson {lesson_num}"
 
-            # Look up lesson link
-            link = None
-            if lesson_num is not None:
-                link = self.store.get_lesson_link(course_title, lesson_num)
+                # Look up lesson link, reusing it for chunks of the same lesson
+                key = (course_title, lesson_num)
+                if key not in link_cache:
+                    link_cache[key] = self.store.get_lesson_link(
+                        course_title, lesson_num
+                    )
+                link = link_cache[key]
 
             # Store source as dict with text and optional link
             sources.append({"text": source_text, "link": link})
 
-            formatted.append(f"{header}\n{doc}")
+            # Context header matches the source text
+            formatted.append(f"[{source_text}]\n{doc}")
 
-        # Store sources for retrieval
-        self.last_sources = sources
-
-        return "\n\n".join(formatted)
+        return "\n\n".join(formatted), sources
 
 
 class CourseOutlineTool(Tool):
     """Tool for retrieving course outline information including lessons"""
 
+    _DEFINITION = {
+        "name": "get_course_outline",
+        "description": "Get the complete outline of a course including course title, course link, and all lessons with their numbers and titles. Use this tool when the user asks about what a course covers, its structure, lessons, or outline.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "course_title": {
+                    "type": "string",
+                    "description": "The course title to look up (partial matches work, e.g. 'MCP', 'Introduction')",
+                }
+            },
+            "required": ["course_title"],
+        },
+    }
+
     def __init__(self, vector_store: VectorStore):
         self.store = vector_store
-        self.last_sources = []  # Track sources from last query
+
+        # Course titles are a small, stable set, so catalog lookups are memoized
+        self._cached_course_name = functools.lru_cache(maxsize=256)(
+            self._query_course_name
+        )
+        self._load_course_metadata = functools.lru_cache(maxsize=256)(
+            self._fetch_course_metadata
+        )
 
     def get_tool_definition(self) -> Dict[str, Any]:
         """Return Anthropic tool definition for this tool"""
-        return {
-            "name": "get_course_outline",
-            "description": "Get the complete outline of a course including course title, course link, and all lessons with their numbers and titles. Use this tool when the user asks about what a course covers, its structure, lessons, or outline.",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "course_title": {
-                        "type": "string",
-                        "description": "The course title to look up (partial matches work, e.g. 'MCP', 'Introduction')",
-                    }
-                },
-                "required": ["course_title"],
-            },
-        }
+        return self._DEFINITION
 
     def execute(self, course_title: str) -> str:
         """
@@ -158,67 +195,92 @@ class CourseOutlineTool(Tool):
         Returns:
             Formatted course outline or error message
         """
-        import json
+        result, _ = self.run(course_title=course_title)
+        return result
 
+    def run(self, course_title: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """Look up an outline and return (result, sources) for this call"""
         # Use vector search to resolve the course name
         resolved_title = self._resolve_course_name(course_title)
         if not resolved_title:
-            return f"No course found matching '{course_title}'"
+            return f"No course found matching '{course_title}'", []
 
         # Get the course metadata
         try:
-            results = self.store.course_catalog.get(ids=[resolved_title])
-            if not results or not results["metadatas"] or not results["metadatas"][0]:
-                return f"Could not retrieve metadata for course '{resolved_title}'"
-
-            metadata = results["metadatas"][0]
-            course_link = metadata.get("course_link", "No link available")
-            lessons_json = metadata.get("lessons_json", "[]")
-            lessons = json.loads(lessons_json)
+            course_metadata = self._load_course_metadata(resolved_title)
+            if not course_metadata:
+                return (
+                    f"Could not retrieve metadata for course '{resolved_title}'",
+                    [],
+                )
 
-            # Store source for the UI
-            self.last_sources = [{"text": resolved_title, "link": course_link}]
+            course_link, lessons = course_metadata
 
-            # Format the response
-            return self._format_outline(resolved_title, course_link, lessons)
+            # Format the response, with the course as the source for the UI
+            return self._format_outline(resolved_title, course_link, lessons), [
+                {"text": resolved_title, "link": course_link}
+            ]
 
         except Exception as e:
-            return f"Error retrieving course outline: {str(e)}"
+            return f"Error retrieving course outline: {str(e)}", []
+
+    def clear_cache(self):
+        """Forget memoized catalog lookups, e.g. after courses are added"""
+        self._cached_course_name.cache_clear()
+        self._load_course_metadata.cache_clear()
 
     def _resolve_course_name(self, course_name: str) -> Optional[str]:
         """Use vector search to find best matching course by name"""
         try:
-            results = self.store.course_catalog.query(
-                query_texts=[course_name], n_results=1
-            )
-
-            if results["documents"][0] and results["metadatas"][0]:
-                return results["metadatas"][0][0]["title"]
+            return self._cached_course_name(course_name)
         except Exception as e:
             print(f"Error resolving course name: {e}")
 
         return None
 
-    def _format_outline(self, title: str, course_link: str, lessons: list) -> str:
-        """Format the course outline for display"""
-        formatted = []
-        formatted.append(f"Course Title: {title}")
-        formatted.append(f"Course Link: {course_link}")
-        formatted.append(f"\nLessons ({len(lessons)} total):")
+    def _query_course_name(self, course_name: str) -> Optional[str]:
+        """Query the catalog for a course title (errors propagate, so not cached)"""
+        results = self.store.course_catalog.query(
+            query_texts=[course_name], n_results=1
+        )
+
+        if results["documents"][0] and results["metadatas"][0]:
+            return results["metadatas"][0][0]["title"]
+        return None
+
+    def _fetch_course_metadata(self, course_title: str) -> Optional[Tuple[str, list]]:
+        """Fetch a course's link and parsed lesson list from the catalog"""
+        results = self.store.course_catalog.get(ids=[course_title])
+        if not results or not results["metadatas"] or not results["metadatas"][0]:
+            return None
 
-        for lesson in lessons:
-            lesson_num = lesson.get("lesson_number", "?")
-            lesson_title = lesson.get("lesson_title", "Untitled")
-            formatted.append(f"  Lesson {lesson_num}: {lesson_title}")
+        metadata = results["metadatas"][0]
+        course_link = metadata.get("course_link", "No link available")
+        lessons = json_loads(metadata.get("lessons_json", "[]"))
+        return course_link, lessons
 
-        return "\n".join(formatted)
+    def _format_outline(self, title: str, course_link: str, lessons: list) -> str:
+        """Format the course outline for display"""
+        header = (
+            f"Course Title: {title}",
+            f"Course Link: {course_link}",
+            f"\nLessons ({len(lessons)} total):",
+        )
+        lesson_lines = (
+            f"  Lesson {lesson.get('lesson_number', '?')}: "
+            f"{lesson.get('lesson_title', 'Untitled')}"
+            for lesson in lessons
+        )
+        return "\n".join(itertools.chain(header, lesson_lines))
 
 
 class ToolManager:
-    """Manages available tools for the AI"""
+    """Manages available tools for the AI; queries run them via for_request()"""
 
     def __init__(self):
         self.tools = {}
+        self._definitions = []  # Cached tool definitions, rebuilt on register
+        self._runners = {}  # Tool name -> bound run method, the per-call hot path
 
     def register_tool(self, tool: Tool):
         """Register any tool that implements the Tool interface"""
@@ -227,28 +289,55 @@ class ToolManager:
         if not tool_name:
             raise ValueError("Tool must have a 'name' in its definition")
         self.tools[tool_name] = tool
+        self._runners[tool_name] = tool.run
+        self._definitions = [t.get_tool_definition() for t in self.tools.values()]
+
+    def get_tool_definitions(self) -> list:
+        """Get all tool definitions for Anthropic tool calling (shared, do not mutate)"""
+        return self._definitions
+
+    def for_request(self) -> "RequestTools":
+        """Tool access for one query, with sources kept apart from other queries"""
+        return RequestTools(self)
+
+
+class RequestTools:
+    """
+    Executes a single query's tool calls against a shared ToolManager.
+
+    Sources are recorded per call instead of on the shared tool instances,
+    so concurrent queries (and parallel calls within one query) cannot see
+    or overwrite each other's sources.
+    """
+
+    def __init__(self, manager: ToolManager):
+        self._manager = manager
+        self._runners = manager._runners  # Shared, so later registrations apply
+        self._sources: List[List[Dict[str, Any]]] = []  # Per call, in start order
+        self.failed = False  # Set once any tool call raises
 
     def get_tool_definitions(self) -> list:
-        """Get all tool definitions for Anthropic tool calling"""
-        return [tool.get_tool_definition() for tool in self.tools.values()]
+        """Get all tool definitions for Anthropic tool calling (shared, do not mutate)"""
+        return self._manager.get_tool_definitions()
 
     def execute_tool(self, tool_name: str, **kwargs) -> str:
-        """Execute a tool by name with given parameters"""
-        if tool_name not in self.tools:
+        """Execute a tool by name, recording the sources this call produced"""
+        run = self._runners.get(tool_name)
+        if run is None:
             return f"Tool '{tool_name}' not found"
 
-        return self.tools[tool_name].execute(**kwargs)
-
-    def get_last_sources(self) -> list:
-        """Get sources from the last search operation"""
-        # Check all tools for last_sources attribute
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources") and tool.last_sources:
-                return tool.last_sources
-        return []
-
-    def reset_sources(self):
-        """Reset sources from all tools that track sources"""
-        for tool in self.tools.values():
-            if hasattr(tool, "last_sources"):
-                tool.last_sources = []
+        # Reserve a slot first so sources follow call order, not finish order;
+        # list.append is atomic, so the generator's pool threads need no lock
+        slot: List[Dict[str, Any]] = []
+        self._sources.append(slot)
+        try:
+            result, sources = run(**kwargs)
+        except Exception:
+            self.failed = True
+            raise
+        slot.extend(sources)
+        return result
+
+    def get_sources(self) -> List[Dict[str, Any]]:
+        """Sources from every tool call of this query, in call order"""
+        return [source for call in self._sources for source in call]
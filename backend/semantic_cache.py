@@ -0,0 +1,137 @@
+import hashlib
+import json
+import re
+import time
+from typing import List, Dict, Optional, Tuple
+from vector_store import VectorStore
+
+# Lesson numbers and names (course titles, acronyms) change the answer while
+# barely moving a sentence embedding, so they must match exactly
+_KEY_TERM = re.compile(r"\d+|\b[A-Z][\w-]+")
+
+
+def _key_terms(query: str) -> str:
+    """Sorted, casefolded numbers and capitalised words of a query"""
+    terms = _KEY_TERM.findall(query)
+    # An opening word in sentence case ("What", "Explain") is not a name
+    if terms and query.lstrip().startswith(terms[0]) and terms[0][1:].islower():
+        terms = terms[1:]
+    return " ".join(sorted({term.casefold() for term in terms}))
+
+
+class SemanticCache:
+    """
+    Caches answers to standalone queries, matched by embedding similarity.
+
+    Entries are tagged with a version; only entries of the current version
+    are served, so answers produced under an older prompt, model or tool set
+    stop matching (and age out through eviction) once the version changes.
+    A hit also requires the same numbers and names as the cached query, so
+    "lesson 1 of MCP" never serves the answer to "lesson 2 of MCP".
+    """
+
+    COLLECTION_NAME = "response_cache"
+
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        max_entries: int = 500,
+        distance_threshold: float = 0.05,
+        version: str = "",
+    ):
+        self.vector_store = vector_store
+        self.max_entries = max_entries
+        self.distance_threshold = distance_threshold
+        self.version = version
+        self.collection = self._create_collection()
+
+    def _create_collection(self):
+        """Create or get the cache collection, embedded with the store's model"""
+        return self.vector_store.client.get_or_create_collection(
+            name=self.COLLECTION_NAME,
+            embedding_function=self.vector_store.embedding_function,
+            metadata={"hnsw:space": "cosine"},
+        )
+
+    def lookup(self, query: str) -> Optional[Tuple[str, List[Dict]]]:
+        """
+        Find a cached answer for a semantically equivalent query.
+
+        Args:
+            query: The user's question
+
+        Returns:
+            Tuple of (answer, sources) on a cache hit, otherwise None
+        """
+        try:
+            results = self.collection.query(
+                query_texts=[query],
+                n_results=1,
+                where={
+                    "$and": [
+                        {"version": self.version},
+                        {"key_terms": _key_terms(query)},
+                    ]
+                },
+                include=["metadatas", "distances"],
+            )
+            if not results["ids"][0]:
+                return None
+            if results["distances"][0][0] > self.distance_threshold:
+                return None
+
+            entry_id = results["ids"][0][0]
+            metadata = results["metadatas"][0][0]
+
+            # Refresh recency so eviction drops the least recently used entries
+            self.collection.update(
+                ids=[entry_id], metadatas=[{**metadata, "last_used": time.time()}]
+            )
+            return metadata["answer"], json.loads(metadata["sources_json"])
+        except Exception as e:
+            print(f"Error reading response cache: {e}")
+            return None
+
+    def store(self, query: str, answer: str, sources: List[Dict]):
+        """Cache the answer and sources produced for a query"""
+        if not answer.strip():
+            return
+
+        try:
+            self.collection.upsert(
+                ids=[hashlib.sha256(query.encode("utf-8")).hexdigest()],
+                documents=[query],
+                metadatas=[
+                    {
+                        "answer": answer,
+                        "sources_json": json.dumps(sources),
+                        "last_used": time.time(),
+                        "version": self.version,
+                        "key_terms": _key_terms(query),
+                    }
+                ],
+            )
+            self._evict()
+        except Exception as e:
+            print(f"Error writing response cache: {e}")
+
+    def _evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        overflow = self.collection.count() - self.max_entries
+        if overflow <= 0:
+            return
+
+        entries = self.collection.get(include=["metadatas"])
+        by_recency = sorted(
+            zip(entries["ids"], entries["metadatas"]),
+            key=lambda entry: entry[1].get("last_used", 0),
+        )
+        self.collection.delete(ids=[entry_id for entry_id, _ in by_recency[:overflow]])
+
+    def clear(self):
+        """Remove all cached answers, e.g. after the course content changes"""
+        try:
+            self.vector_store.client.delete_collection(self.COLLECTION_NAME)
+            self.collection = self._create_collection()
+        except Exception as e:
+            print(f"Error clearing response cache: {e}")
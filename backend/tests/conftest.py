@@ -1,31 +1,33 @@
 """Shared fixtures for RAG chatbot tests."""
 
+import copy
+import dataclasses
+import json
 import pytest
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
-from unittest.mock import Mock, MagicMock, patch
+from types import SimpleNamespace
+from typing import List, Dict, Optional
+from unittest.mock import AsyncMock, Mock, create_autospec
 
-import sys
-import os
-
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from vector_store import SearchResults
 from config import Config
+from tests.factories import EMPTY_TOOL_DEFS, text_response, tool_use_response
 
 # API testing imports
+import httpx
 from fastapi import FastAPI, HTTPException
-from fastapi.testclient import TestClient
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-
+# Backend modules that pull in chromadb, sentence-transformers or the
+# Anthropic SDK are imported inside the fixtures that use them, so tests
+# that only need Config do not pay for loading them at collection time.
 
 # --- SearchResults Factories ---
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def empty_search_results():
     """Factory for empty SearchResults."""
+    from vector_store import SearchResults
 
     def _factory(error: Optional[str] = None):
         return SearchResults(documents=[], metadata=[], distances=[], error=error)
@@ -33,9 +35,10 @@ def empty_search_results():
     return _factory
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def valid_search_results():
     """Factory for valid SearchResults with sample data."""
+    from vector_store import SearchResults
 
     def _factory(num_results: int = 3):
         documents = [
@@ -54,9 +57,10 @@ def valid_search_results():
     return _factory
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_search_results():
     """Factory for error SearchResults."""
+    from vector_store import SearchResults
 
     def _factory(error_msg: str = "Search error occurred"):
         return SearchResults.empty(error_msg)
@@ -64,13 +68,58 @@ def error_search_results():
     return _factory
 
 
+@pytest.fixture(scope="module")
+def db_error_search_results():
+    """Prebuilt SearchResults for a failed search. Read-only."""
+    from vector_store import SearchResults
+
+    return SearchResults.empty("Database connection failed")
+
+
+@pytest.fixture(scope="module")
+def populated_search_results():
+    """Prebuilt SearchResults with one lesson chunk. Read-only."""
+    from vector_store import SearchResults
+
+    return SearchResults(
+        documents=["Lesson content"],
+        metadata=[{"course_title": "Test Course", "lesson_number": 1}],
+        distances=[0.1],
+    )
+
+
 # --- Mock VectorStore ---
 
+# VectorStore attributes the tools and RAGSystem touch; spec_set keeps the
+# mocks to this interface without introspecting the real class
+_VECTOR_STORE_ATTRS = [
+    "max_results",
+    "course_catalog",
+    "search",
+    "get_lesson_link",
+    "get_course_link",
+    "get_existing_course_titles",
+    "add_course_metadata",
+    "add_course_content",
+]
+
 
 @pytest.fixture
 def mock_vector_store():
     """Mock VectorStore with configurable behavior."""
-    mock = Mock()
+    return _build_mock_vector_store()
+
+
+@pytest.fixture(scope="module")
+def mock_vector_store_module():
+    """Mock VectorStore shared by a module's tests. Do not reconfigure it."""
+    return _build_mock_vector_store()
+
+
+def _build_mock_vector_store():
+    from vector_store import SearchResults
+
+    mock = Mock(spec_set=_VECTOR_STORE_ATTRS)
     mock.max_results = 5
     mock.search = Mock(
         return_value=SearchResults(
@@ -90,7 +139,9 @@ def mock_vector_store():
 @pytest.fixture
 def mock_vector_store_empty():
     """Mock VectorStore that returns empty results (simulates MAX_RESULTS=0 bug)."""
-    mock = Mock()
+    from vector_store import SearchResults
+
+    mock = Mock(spec_set=_VECTOR_STORE_ATTRS)
     mock.max_results = 0
     mock.search = Mock(
         return_value=SearchResults(documents=[], metadata=[], distances=[], error=None)
@@ -103,122 +154,261 @@ def mock_vector_store_empty():
 
 
 @pytest.fixture
-def mock_anthropic_client():
-    """Mock Anthropic client."""
-    mock = Mock()
-    return mock
+def anthropic_client():
+    """Mock Anthropic client that the generator fixture installs."""
+    client = Mock()
+    client.messages.create = AsyncMock()
+    return client
+
+
+@pytest.fixture(scope="module")
+def generator_prototype():
+    """AIGenerator built once per module; tests get shallow copies."""
+    from ai_generator import AIGenerator
+
+    # No real client or connection pool; each copy gets a mock client
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("anthropic.AsyncAnthropic", Mock)
+        monkeypatch.setattr("anthropic.DefaultAsyncHttpxClient", Mock)
+        prototype = AIGenerator(api_key="test-key", model="test-model")
+    yield prototype
+    prototype._executor.shutdown(wait=False)
 
 
 @pytest.fixture
+def generator(generator_prototype, anthropic_client):
+    """AIGenerator wired to the test's mock Anthropic client."""
+    generator = copy.copy(generator_prototype)
+    generator.client = anthropic_client
+    return generator
+
+
+@pytest.fixture(scope="session")
 def mock_text_response():
     """Factory for mock text responses from Claude."""
+    return text_response
 
-    def _factory(text: str = "This is a test response."):
-        response = Mock()
-        response.stop_reason = "end_turn"
-        content_block = Mock()
-        content_block.type = "text"
-        content_block.text = text
-        response.content = [content_block]
-        return response
 
-    return _factory
+@pytest.fixture(scope="session")
+def mock_tool_use_response():
+    """Factory for mock tool_use responses from Claude, memoized by arguments."""
+    return tool_use_response
 
 
 @pytest.fixture
-def mock_tool_use_response():
-    """Factory for mock tool_use responses from Claude."""
+def tool_manager():
+    """RequestTools mock; tests set execute_tool's return_value/side_effect."""
+    from search_tools import RequestTools
 
-    def _factory(
-        tool_name: str = "search_course_content",
-        tool_input: Dict = None,
-        tool_id: str = "tool_123",
-    ):
-        if tool_input is None:
-            tool_input = {"query": "machine learning"}
+    manager = Mock(spec=RequestTools)
+    manager.get_tool_definitions.return_value = EMPTY_TOOL_DEFS
+    return manager
 
-        response = Mock()
-        response.stop_reason = "tool_use"
 
-        tool_block = Mock()
-        tool_block.type = "tool_use"
-        tool_block.name = tool_name
-        tool_block.input = tool_input
-        tool_block.id = tool_id
+@pytest.fixture
+def setup_generator(anthropic_client, generator, tool_manager):
+    """
+    Callable that scripts Claude's responses and the tool results.
+
+    A string tool result is returned for every call; anything else (a list,
+    exception or callable) becomes execute_tool's side_effect.
+    Returns (generator, tool_manager).
+    """
 
-        response.content = [tool_block]
-        return response
+    def _setup(responses, tool_results=None):
+        anthropic_client.messages.create.side_effect = responses
+        if isinstance(tool_results, str):
+            tool_manager.execute_tool.return_value = tool_results
+        elif tool_results is not None:
+            tool_manager.execute_tool.side_effect = tool_results
+        return generator, tool_manager
 
-    return _factory
+    return _setup
 
 
 # --- Config Fixtures ---
 
 
+@pytest.fixture(scope="session")
+def _config_template():
+    """Config pointing at a test API key and database, built once."""
+    return Config(ANTHROPIC_API_KEY="test-api-key", CHROMA_PATH="./test_chroma_db")
+
+
+@pytest.fixture(scope="session")
+def broken_config(_config_template):
+    """Config with MAX_RESULTS=0 (the bug). Shared per session, do not mutate."""
+    return dataclasses.replace(_config_template, MAX_RESULTS=0)
+
+
+@pytest.fixture(scope="session")
+def working_config(_config_template):
+    """Config with MAX_RESULTS=5 (correct value). Shared per session, do not mutate."""
+    return dataclasses.replace(_config_template, MAX_RESULTS=5)
+
+
+# --- RAGSystem Dependency Fixtures ---
+
+
+@pytest.fixture(scope="session")
+def rag_system_cls():
+    """RAGSystem class, imported on first use."""
+    from rag_system import RAGSystem
+
+    return RAGSystem
+
+
+_RAG_DEPENDENCIES = (
+    "VectorStore",
+    "AIGenerator",
+    "DocumentProcessor",
+    "SessionManager",
+    "SemanticCache",
+)
+
+
+def _patch_rag_dependencies(monkeypatch) -> Dict[str, Mock]:
+    """Swap RAGSystem's collaborators for autospec'd class mocks."""
+    import rag_system
+
+    mocks = {}
+    for name in _RAG_DEPENDENCIES:
+        mocks[name] = create_autospec(getattr(rag_system, name))
+        monkeypatch.setattr(rag_system, name, mocks[name])
+
+    mocks["SemanticCache"].return_value.lookup.return_value = None
+    # Autospec turns plain attributes into mocks; RAGSystem hashes the prompt
+    mocks["AIGenerator"].return_value.SYSTEM_PROMPT = "System prompt"
+    mocks["SessionManager"].return_value.get_conversation_history.return_value = None
+    return mocks
+
+
 @pytest.fixture
-def broken_config():
-    """Config with MAX_RESULTS=0 (the bug)."""
-    config = Config()
-    config.MAX_RESULTS = 0
-    config.ANTHROPIC_API_KEY = "test-api-key"
-    config.CHROMA_PATH = "./test_chroma_db"
-    return config
+def rag_mocks(monkeypatch):
+    """
+    Replace RAGSystem's collaborators with autospec'd class mocks.
+
+    Returns a dict of class mocks keyed by class name; the instance a
+    RAGSystem receives is each mock's return_value. The response cache
+    always misses and sessions have no history unless a test says otherwise.
+    """
+    return _patch_rag_dependencies(monkeypatch)
 
 
 @pytest.fixture
-def working_config():
-    """Config with MAX_RESULTS=5 (correct value)."""
-    config = Config()
-    config.MAX_RESULTS = 5
-    config.ANTHROPIC_API_KEY = "test-api-key"
-    config.CHROMA_PATH = "./test_chroma_db"
-    return config
+def configured_rag_system(rag_system_cls, rag_mocks, working_config):
+    """
+    RAGSystem over rag_mocks whose AI generator answers "Response".
+
+    Returns (system, mocks) where mocks holds the collaborator instances.
+    """
+    mocks = SimpleNamespace(
+        ai_generator=rag_mocks["AIGenerator"].return_value,
+        vector_store=rag_mocks["VectorStore"].return_value,
+        session_manager=rag_mocks["SessionManager"].return_value,
+        response_cache=rag_mocks["SemanticCache"].return_value,
+    )
+    mocks.ai_generator.generate_response.return_value = "Response"
+    return rag_system_cls(working_config), mocks
+
+
+@pytest.fixture(scope="module")
+def shared_rag_system(rag_system_cls, working_config):
+    """
+    RAGSystem over mocked collaborators, built once per module.
+
+    Its AI generator answers "Response". Tests may query it and inspect the
+    latest calls but must not reconfigure it.
+    """
+    # Patch only while constructing, so function-scoped rag_mocks still works
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        _patch_rag_dependencies(monkeypatch)
+        system = rag_system_cls(working_config)
+    system.ai_generator.generate_response.return_value = "Response"
+    return system
 
 
 # --- API Testing Fixtures ---
 
-@pytest.fixture
+
+@pytest.fixture(scope="session")
 def mock_rag_system():
     """Mock RAGSystem for API testing."""
     mock = Mock()
     mock.session_manager = Mock()
     mock.session_manager.create_session = Mock(return_value="test-session-123")
-    mock.query = Mock(return_value=(
-        "This is a test response about machine learning.",
-        [{"text": "Source 1: ML basics", "link": "https://example.com/ml"}]
-    ))
-    mock.get_course_analytics = Mock(return_value={
-        "total_courses": 3,
-        "course_titles": ["Course A", "Course B", "Course C"]
-    })
+    mock.query = AsyncMock(
+        return_value=(
+            "This is a test response about machine learning.",
+            [{"text": "Source 1: ML basics", "link": "https://example.com/ml"}],
+        )
+    )
+    mock.query_stream = Mock(
+        side_effect=_stream_events(
+            {"type": "text", "text": "This is a test response "},
+            {"type": "text", "text": "about machine learning."},
+            {
+                "type": "sources",
+                "sources": [
+                    {"text": "Source 1: ML basics", "link": "https://example.com/ml"}
+                ],
+            },
+        )
+    )
+    mock.get_course_analytics = Mock(
+        return_value={
+            "total_courses": 3,
+            "course_titles": ["Course A", "Course B", "Course C"],
+        }
+    )
     return mock
 
 
-@pytest.fixture
+def _stream_events(*events, error: Optional[Exception] = None):
+    """query_stream stand-in yielding events, then raising error if given."""
+
+    async def _query_stream(query, session_id):
+        for event in events:
+            yield event
+        if error is not None:
+            raise error
+
+    return _query_stream
+
+
+@pytest.fixture(scope="session")
 def mock_rag_system_error():
     """Mock RAGSystem that raises exceptions."""
     mock = Mock()
     mock.session_manager = Mock()
     mock.session_manager.create_session = Mock(return_value="test-session-123")
-    mock.query = Mock(side_effect=Exception("RAG system error"))
+    mock.query = AsyncMock(side_effect=Exception("RAG system error"))
+    mock.query_stream = Mock(
+        side_effect=_stream_events(
+            {"type": "text", "text": "Partial"},
+            error=Exception("RAG system error"),
+        )
+    )
     mock.get_course_analytics = Mock(side_effect=Exception("Analytics error"))
     return mock
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_rag_system_empty():
     """Mock RAGSystem that returns empty results."""
     mock = Mock()
     mock.session_manager = Mock()
     mock.session_manager.create_session = Mock(return_value="test-session-456")
-    mock.query = Mock(return_value=(
-        "I couldn't find relevant information.",
-        []
-    ))
-    mock.get_course_analytics = Mock(return_value={
-        "total_courses": 0,
-        "course_titles": []
-    })
+    mock.query = AsyncMock(return_value=("I couldn't find relevant information.", []))
+    mock.query_stream = Mock(
+        side_effect=_stream_events(
+            {"type": "text", "text": "I couldn't find relevant information."},
+            {"type": "sources", "sources": []},
+        )
+    )
+    mock.get_course_analytics = Mock(
+        return_value={"total_courses": 0, "course_titles": []}
+    )
     return mock
 
 
@@ -229,9 +419,6 @@ def create_test_app(mock_rag_system):
     This avoids import issues with the main app.py which mounts static files
     that don't exist in the test environment.
     """
-    from pydantic import BaseModel
-    from typing import List, Optional
-
     app = FastAPI(title="Test Course Materials RAG System")
 
     class QueryRequest(BaseModel):
@@ -258,23 +445,37 @@ def create_test_app(mock_rag_system):
             if not session_id:
                 session_id = mock_rag_system.session_manager.create_session()
 
-            answer, sources = mock_rag_system.query(request.query, session_id)
+            answer, sources = await mock_rag_system.query(request.query, session_id)
 
-            return QueryResponse(
-                answer=answer,
-                sources=sources,
-                session_id=session_id
-            )
+            return QueryResponse(answer=answer, sources=sources, session_id=session_id)
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.post("/api/query/stream")
+    async def stream_query(request: QueryRequest):
+        session_id = request.session_id
+        if not session_id:
+            session_id = mock_rag_system.session_manager.create_session()
+
+        async def events():
+            yield json.dumps({"type": "session", "session_id": session_id}) + "\n"
+            try:
+                async for event in mock_rag_system.query_stream(
+                    request.query, session_id
+                ):
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
     @app.get("/api/courses", response_model=CourseStats)
     async def get_course_stats():
         try:
             analytics = mock_rag_system.get_course_analytics()
             return CourseStats(
                 total_courses=analytics["total_courses"],
-                course_titles=analytics["course_titles"]
+                course_titles=analytics["course_titles"],
             )
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -286,27 +487,51 @@ def create_test_app(mock_rag_system):
     return app
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_app(mock_rag_system):
     """Create a test FastAPI app with mocked RAG system."""
     return create_test_app(mock_rag_system)
 
 
+@pytest.fixture(scope="session")
+def test_app_error(mock_rag_system_error):
+    """Create a test FastAPI app with error-raising RAG system."""
+    return create_test_app(mock_rag_system_error)
+
+
+@pytest.fixture(scope="session")
+def test_app_empty(mock_rag_system_empty):
+    """Create a test FastAPI app with empty-returning RAG system."""
+    return create_test_app(mock_rag_system_empty)
+
+
 @pytest.fixture
-def test_client(test_app):
-    """Create a test client for the FastAPI app."""
-    return TestClient(test_app)
+async def async_client(test_app, mock_rag_system):
+    """
+    Async HTTP client calling the test app in-process.
+
+    Call records on the shared mock_rag_system are cleared after each test.
+    """
+    async with _client_for(test_app) as client:
+        yield client
+    mock_rag_system.reset_mock()
 
 
 @pytest.fixture
-def test_client_error(mock_rag_system_error):
-    """Create a test client with error-raising RAG system."""
-    app = create_test_app(mock_rag_system_error)
-    return TestClient(app)
+async def async_client_error(test_app_error):
+    """Async HTTP client for the error-raising app."""
+    async with _client_for(test_app_error) as client:
+        yield client
 
 
 @pytest.fixture
-def test_client_empty(mock_rag_system_empty):
-    """Create a test client with empty-returning RAG system."""
-    app = create_test_app(mock_rag_system_empty)
-    return TestClient(app)
+async def async_client_empty(test_app_empty):
+    """Async HTTP client for the empty-returning app."""
+    async with _client_for(test_app_empty) as client:
+        yield client
+
+
+def _client_for(app):
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    )
@@ -0,0 +1,40 @@
+"""Builders for stub Claude API responses, importable at module scope."""
+
+import functools
+from types import SimpleNamespace
+from typing import Dict
+
+# Shared tool definition lists; the code under test must not mutate them
+EMPTY_TOOL_DEFS = []
+SEARCH_TOOL_DEFS = [{"name": "search_course_content", "description": "Search"}]
+
+
+def text_response(text: str = "This is a test response."):
+    """Build an end_turn response with a single text block."""
+    return SimpleNamespace(
+        stop_reason="end_turn", content=[SimpleNamespace(type="text", text=text)]
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _tool_use_response(tool_name: str, tool_id: str, tool_input: frozenset):
+    # Responses are only read by the code under test, so sharing them is safe
+    return SimpleNamespace(
+        stop_reason="tool_use",
+        content=[
+            SimpleNamespace(
+                type="tool_use", id=tool_id, name=tool_name, input=dict(tool_input)
+            )
+        ],
+    )
+
+
+def tool_use_response(
+    tool_name: str = "search_course_content",
+    tool_input: Dict = None,
+    tool_id: str = "tool_123",
+):
+    """Build a tool_use response with a single tool_use block, memoized by arguments."""
+    if tool_input is None:
+        tool_input = {"query": "machine learning"}
+    return _tool_use_response(tool_name, tool_id, frozenset(tool_input.items()))
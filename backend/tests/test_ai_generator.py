@@ -1,105 +1,111 @@
 """Tests for AIGenerator tool calling functionality."""
 
 import pytest
-from unittest.mock import Mock, MagicMock, patch
-
-import sys
-import os
-
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from ai_generator import AIGenerator
-from search_tools import ToolManager, CourseSearchTool
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, MagicMock
+
+from tests.factories import SEARCH_TOOL_DEFS, text_response, tool_use_response
+
+# Common create() sequences, built once; tests assign copies since the mock
+# consumes side_effect lists as an iterator
+_SEQ_TOOL_THEN_TEXT = [
+    tool_use_response(tool_id="toolu_1"),
+    text_response("Final answer"),
+]
+_SEQ_TWO_TOOLS_THEN_TEXT = [
+    tool_use_response(tool_id="toolu_1"),
+    tool_use_response(tool_id="toolu_2"),
+    text_response("Final answer"),
+]
+
+_HISTORY_STR = "User: What is ML?\nAssistant: ML is..."
+
+# Read-only stand-in for a vector store SearchResults
+_SEARCH_RESULT = SimpleNamespace(
+    documents=["ML content"],
+    metadata=[{"course_title": "ML Course", "lesson_number": 1}],
+    error=None,
+    is_empty=lambda: False,
+)
 
 
 class TestAIGeneratorNonToolResponses:
     """Tests for non-tool responses from AIGenerator."""
 
-    def test_simple_text_response(self, mock_text_response):
+    async def test_simple_text_response(
+        self, anthropic_client, generator, mock_text_response
+    ):
         """Test handling of simple text responses without tool use."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.return_value = mock_text_response(
-                "Hello, how can I help?"
-            )
-            mock_anthropic.return_value = mock_client
+        anthropic_client.messages.create.return_value = mock_text_response(
+            "Hello, how can I help?"
+        )
 
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(query="Hello")
+        response = await generator.generate_response(query="Hello")
 
-            assert response == "Hello, how can I help?"
-            mock_client.messages.create.assert_called_once()
+        assert response == "Hello, how can I help?"
+        anthropic_client.messages.create.assert_called_once()
 
-    def test_response_without_tools(self, mock_text_response):
+    async def test_response_without_tools(
+        self, anthropic_client, generator, mock_text_response
+    ):
         """Test response generation when no tools are provided."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.return_value = mock_text_response(
-                "General knowledge answer"
-            )
-            mock_anthropic.return_value = mock_client
+        anthropic_client.messages.create.return_value = mock_text_response(
+            "General knowledge answer"
+        )
 
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(
-                query="What is Python?", tools=None, tool_manager=None
-            )
+        response = await generator.generate_response(
+            query="What is Python?", tools=None, tool_manager=None
+        )
 
-            assert response == "General knowledge answer"
-            # Verify tools parameter not in API call
-            call_kwargs = mock_client.messages.create.call_args[1]
-            assert "tools" not in call_kwargs
+        assert response == "General knowledge answer"
+        # Verify tools parameter not in API call
+        call_kwargs = anthropic_client.messages.create.call_args.kwargs
+        assert "tools" not in call_kwargs
 
 
 class TestAIGeneratorToolUse:
     """Tests for tool use detection and execution."""
 
-    def test_tool_use_detection(self, mock_tool_use_response, mock_text_response):
+    async def test_tool_use_detection(
+        self, anthropic_client, generator, mock_tool_use_response, mock_text_response
+    ):
         """Test that tool_use stop_reason triggers tool execution."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            # First call returns tool_use, second returns text
-            mock_client.messages.create.side_effect = [
-                mock_tool_use_response(),
-                mock_text_response(
-                    "Based on the search results, machine learning is..."
-                ),
-            ]
-            mock_anthropic.return_value = mock_client
-
-            # Set up tool manager
-            mock_store = Mock()
-            mock_store.search = Mock(
-                return_value=Mock(
-                    documents=["ML content"],
-                    metadata=[{"course_title": "ML Course", "lesson_number": 1}],
-                    error=None,
-                    is_empty=Mock(return_value=False),
-                )
-            )
-            mock_store.get_lesson_link = Mock(return_value=None)
-
-            tool_manager = ToolManager()
-            tool = CourseSearchTool(mock_store)
-            tool_manager.register_tool(tool)
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(
-                query="What is machine learning?",
-                tools=tool_manager.get_tool_definitions(),
-                tool_manager=tool_manager,
-            )
-
-            # Should have made two API calls
-            assert mock_client.messages.create.call_count == 2
-            assert "machine learning" in response
-
-    def test_tool_manager_execute_called(
-        self, mock_tool_use_response, mock_text_response
+        from search_tools import ToolManager, CourseSearchTool
+
+        # First call returns tool_use, second returns text
+        anthropic_client.messages.create.side_effect = [
+            mock_tool_use_response(),
+            mock_text_response("Based on the search results, machine learning is..."),
+        ]
+
+        # Set up tool manager
+        mock_store = Mock(spec_set=["search", "get_lesson_link"])
+        mock_store.search.return_value = _SEARCH_RESULT
+        mock_store.get_lesson_link.return_value = None
+
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(mock_store))
+        tool_manager = manager.for_request()
+
+        response = await generator.generate_response(
+            query="What is machine learning?",
+            tools=tool_manager.get_tool_definitions(),
+            tool_manager=tool_manager,
+        )
+
+        # Should have made two API calls
+        assert anthropic_client.messages.create.call_count == 2
+        assert "machine learning" in response
+
+    async def test_tool_manager_execute_called(
+        self,
+        setup_generator,
+        mock_tool_use_response,
+        mock_text_response,
     ):
         """Test that tool_manager.execute_tool() is called with correct parameters."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.side_effect = [
+        generator, tool_manager = setup_generator(
+            [
                 mock_tool_use_response(
                     tool_name="search_course_content",
                     tool_input={
@@ -108,392 +114,653 @@ class TestAIGeneratorToolUse:
                     },
                 ),
                 mock_text_response("Neural networks are..."),
-            ]
-            mock_anthropic.return_value = mock_client
+            ],
+            "Search results about neural networks",
+        )
 
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(
-                return_value="Search results about neural networks"
-            )
-            tool_manager.get_tool_definitions = Mock(return_value=[])
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            generator.generate_response(
-                query="Tell me about neural networks",
-                tools=[],
-                tool_manager=tool_manager,
-            )
+        await generator.generate_response(
+            query="Tell me about neural networks",
+            tools=[],
+            tool_manager=tool_manager,
+        )
 
-            tool_manager.execute_tool.assert_called_once_with(
-                "search_course_content",
-                query="neural networks",
-                course_name="Deep Learning",
-            )
+        tool_manager.execute_tool.assert_called_once_with(
+            "search_course_content",
+            query="neural networks",
+            course_name="Deep Learning",
+        )
 
 
 class TestAIGeneratorMessageSequence:
     """Tests for message sequence building in _handle_tool_execution()."""
 
-    def test_message_sequence_structure(
-        self, mock_tool_use_response, mock_text_response
+    async def test_message_sequence_structure(
+        self,
+        anthropic_client,
+        setup_generator,
+        mock_tool_use_response,
+        mock_text_response,
     ):
         """Test that message sequence is built correctly for tool results."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            tool_response = mock_tool_use_response(tool_id="toolu_123")
-            mock_client.messages.create.side_effect = [
+        tool_response = mock_tool_use_response(tool_id="toolu_123")
+        generator, tool_manager = setup_generator(
+            [
                 tool_response,
                 mock_text_response("Final answer"),
-            ]
-            mock_anthropic.return_value = mock_client
+            ],
+            "Tool result content",
+        )
 
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(return_value="Tool result content")
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            generator.generate_response(
-                query="Test query", tools=[], tool_manager=tool_manager
-            )
+        await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
 
-            # Check the second API call's message structure
-            second_call_kwargs = mock_client.messages.create.call_args_list[1][1]
-            messages = second_call_kwargs["messages"]
+        # Check the second API call's message structure
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        messages = second_call_kwargs["messages"]
 
-            # Should have: user query, assistant tool_use, user tool_result
-            assert len(messages) == 3
-            assert messages[0]["role"] == "user"
-            assert messages[1]["role"] == "assistant"
-            assert messages[2]["role"] == "user"
+        # Should have: user query, assistant tool_use, user tool_result
+        assert len(messages) == 3
+        assert messages[0]["role"] == "user"
+        assert messages[1]["role"] == "assistant"
+        assert messages[2]["role"] == "user"
 
-            # Check tool result structure
-            tool_results = messages[2]["content"]
-            assert len(tool_results) == 1
-            assert tool_results[0]["type"] == "tool_result"
-            assert tool_results[0]["tool_use_id"] == "toolu_123"
-            assert tool_results[0]["content"] == "Tool result content"
+        # Check tool result structure
+        tool_results = messages[2]["content"]
+        assert len(tool_results) == 1
+        assert tool_results[0]["type"] == "tool_result"
+        assert tool_results[0]["tool_use_id"] == "toolu_123"
+        assert tool_results[0]["content"] == "Tool result content"
 
 
 class TestAIGeneratorEmptyToolResults:
     """Tests for handling empty tool results (bug symptom)."""
 
-    def test_empty_tool_result_handling(
-        self, mock_tool_use_response, mock_text_response
+    async def test_empty_tool_result_handling(
+        self,
+        setup_generator,
+        mock_tool_use_response,
+        mock_text_response,
     ):
         """Test handling when tool returns empty/no results (bug symptom).
 
         When MAX_RESULTS=0, the search tool returns "No relevant content found".
         This test verifies the AI generator still processes this case.
         """
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.side_effect = [
+        generator, tool_manager = setup_generator(
+            [
                 mock_tool_use_response(),
                 mock_text_response("I couldn't find relevant information."),
-            ]
-            mock_anthropic.return_value = mock_client
-
-            tool_manager = Mock()
-            # Simulate the bug: tool returns "No relevant content found"
-            tool_manager.execute_tool = Mock(return_value="No relevant content found.")
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(
-                query="What is machine learning?", tools=[], tool_manager=tool_manager
-            )
-
-            # The response should still be generated
-            assert response == "I couldn't find relevant information."
-
-    def test_tool_result_passed_to_final_call(
-        self, mock_tool_use_response, mock_text_response
+            ],
+            "No relevant content found.",
+        )
+
+        # Simulate the bug: tool returns "No relevant content found"
+        response = await generator.generate_response(
+            query="What is machine learning?", tools=[], tool_manager=tool_manager
+        )
+
+        # The response should still be generated
+        assert response == "I couldn't find relevant information."
+
+    async def test_tool_result_passed_to_final_call(
+        self,
+        anthropic_client,
+        setup_generator,
     ):
         """Test that tool results are correctly passed to the final API call."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.side_effect = [
-                mock_tool_use_response(),
-                mock_text_response("Answer based on tool results"),
-            ]
-            mock_anthropic.return_value = mock_client
+        generator, tool_manager = setup_generator(
+            list(_SEQ_TOOL_THEN_TEXT), "Actual search content here"
+        )
 
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(return_value="Actual search content here")
+        await generator.generate_response(
+            query="Test", tools=[], tool_manager=tool_manager
+        )
 
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            generator.generate_response(
-                query="Test", tools=[], tool_manager=tool_manager
-            )
+        # Verify tool result content is in the messages
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        messages = second_call_kwargs["messages"]
+        tool_result_content = messages[2]["content"][0]["content"]
 
-            # Verify tool result content is in the messages
-            second_call_kwargs = mock_client.messages.create.call_args_list[1][1]
-            messages = second_call_kwargs["messages"]
-            tool_result_content = messages[2]["content"][0]["content"]
-
-            assert tool_result_content == "Actual search content here"
+        assert tool_result_content == "Actual search content here"
 
 
 class TestAIGeneratorConversationHistory:
     """Tests for conversation history handling."""
 
-    def test_conversation_history_included(self, mock_text_response):
+    async def test_conversation_history_included(
+        self, anthropic_client, generator, mock_text_response
+    ):
         """Test that conversation history is included in system prompt."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.return_value = mock_text_response("Response")
-            mock_anthropic.return_value = mock_client
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            generator.generate_response(
-                query="Follow up question",
-                conversation_history="User: What is ML?\nAssistant: ML is...",
-            )
+        anthropic_client.messages.create.return_value = mock_text_response("Response")
 
-            call_kwargs = mock_client.messages.create.call_args[1]
-            assert "Previous conversation" in call_kwargs["system"]
-            assert "What is ML?" in call_kwargs["system"]
+        await generator.generate_response(
+            query="Follow up question",
+            conversation_history=_HISTORY_STR,
+        )
+
+        call_kwargs = anthropic_client.messages.create.call_args.kwargs
+        history_block = call_kwargs["system"][-1]
+        assert "Previous conversation" in history_block["text"]
+        assert _HISTORY_STR in history_block["text"]
+        assert "cache_control" not in history_block
+
+    async def test_system_prompt_marked_for_caching(
+        self, anthropic_client, generator, mock_text_response
+    ):
+        """Test that the static system prompt carries the cache marker."""
+        anthropic_client.messages.create.return_value = mock_text_response("Response")
+
+        await generator.generate_response(query="Question")
+
+        call_kwargs = anthropic_client.messages.create.call_args.kwargs
+        assert call_kwargs["system"] == [
+            {
+                "type": "text",
+                "text": generator.SYSTEM_PROMPT,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
 
 
 class TestAIGeneratorSequentialToolCalling:
     """Tests for sequential tool calling functionality."""
 
-    def test_two_sequential_tool_calls(
-        self, mock_tool_use_response, mock_text_response
-    ):
-        """Test that two sequential tool calls are handled correctly."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            # First call: tool_use (get_course_outline)
-            # Second call: tool_use (search_course_content)
-            # Third call: text response
-            mock_client.messages.create.side_effect = [
-                mock_tool_use_response(
-                    tool_name="get_course_outline",
-                    tool_input={"course_title": "Machine Learning Course"},
-                    tool_id="toolu_1",
-                ),
-                mock_tool_use_response(
-                    tool_name="search_course_content",
-                    tool_input={"query": "neural networks"},
-                    tool_id="toolu_2",
-                ),
-                mock_text_response(
-                    "Final answer combining course outline and search results"
-                ),
-            ]
-            mock_anthropic.return_value = mock_client
-
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(
-                side_effect=[
+    @pytest.mark.parametrize(
+        "responses,tool_results",
+        [
+            pytest.param(
+                [
+                    tool_use_response(
+                        tool_name="get_course_outline",
+                        tool_input={"course_title": "Machine Learning Course"},
+                        tool_id="toolu_1",
+                    ),
+                    tool_use_response(
+                        tool_name="search_course_content",
+                        tool_input={"query": "neural networks"},
+                        tool_id="toolu_2",
+                    ),
+                    text_response("Final answer combining outline and search"),
+                ],
+                [
                     "Course outline: Lesson 1, Lesson 2, Lesson 3",
                     "Neural network content from lesson 2",
-                ]
-            )
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(
-                query="What topics are covered in the ML course about neural networks?",
-                tools=[
-                    {"name": "get_course_outline"},
-                    {"name": "search_course_content"},
                 ],
-                tool_manager=tool_manager,
-            )
-
-            # Should have made 3 API calls (initial + 2 tool rounds)
-            assert mock_client.messages.create.call_count == 3
-            # Tool manager should have been called twice
-            assert tool_manager.execute_tool.call_count == 2
-            # Final response should be returned
-            assert "Final answer" in response
-
-    def test_tools_included_in_follow_up_calls(
-        self, mock_tool_use_response, mock_text_response
+                id="outline_then_search",
+            ),
+            pytest.param(
+                [
+                    tool_use_response(
+                        tool_name="search_course_content",
+                        tool_input={"query": "topic B"},
+                        tool_id="toolu_1",
+                    ),
+                    text_response("Final single-search answer"),
+                ],
+                ["Search result"],
+                id="single_search",
+            ),
+        ],
+    )
+    async def test_sequential_tool_rounds(
+        self, anthropic_client, setup_generator, responses, tool_results
+    ):
+        """Test that each tool round adds one API call and accumulates messages."""
+        rounds = len(tool_results)
+        generator, tool_manager = setup_generator(responses, tool_results)
+
+        response = await generator.generate_response(
+            query="Original query",
+            tools=[
+                {"name": "get_course_outline"},
+                {"name": "search_course_content"},
+            ],
+            tool_manager=tool_manager,
+        )
+
+        # One initial call plus one follow-up per tool round
+        assert anthropic_client.messages.create.call_count == rounds + 1
+        assert tool_manager.execute_tool.call_count == rounds
+        assert response == responses[-1].content[0].text
+
+        # Last call carries the query plus a tool_use/tool_result pair per round
+        last_call_kwargs = anthropic_client.messages.create.call_args_list[-1].kwargs
+        roles = [message["role"] for message in last_call_kwargs["messages"]]
+        assert roles == ["user"] + ["assistant", "user"] * rounds
+
+    async def test_tools_included_in_follow_up_calls(
+        self,
+        anthropic_client,
+        setup_generator,
     ):
         """Test that tools are included in follow-up API calls (not stripped)."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.side_effect = [
-                mock_tool_use_response(tool_id="toolu_1"),
-                mock_text_response("Response after tool use"),
-            ]
-            mock_anthropic.return_value = mock_client
-
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(return_value="Tool result")
-
-            tools_definition = [
-                {"name": "search_course_content", "description": "Search"}
-            ]
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            generator.generate_response(
-                query="Test query", tools=tools_definition, tool_manager=tool_manager
-            )
-
-            # Check the second API call includes tools
-            second_call_kwargs = mock_client.messages.create.call_args_list[1][1]
-            assert "tools" in second_call_kwargs
-            assert second_call_kwargs["tools"] == tools_definition
-            assert second_call_kwargs["tool_choice"] == {"type": "auto"}
-
-    def test_max_rounds_limit(self, mock_tool_use_response, mock_text_response):
+        generator, tool_manager = setup_generator(
+            list(_SEQ_TOOL_THEN_TEXT), "Tool result"
+        )
+
+        await generator.generate_response(
+            query="Test query", tools=SEARCH_TOOL_DEFS, tool_manager=tool_manager
+        )
+
+        # Check the second API call includes tools
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        assert "tools" in second_call_kwargs
+        assert second_call_kwargs["tools"] == [
+            {**SEARCH_TOOL_DEFS[0], "cache_control": {"type": "ephemeral"}}
+        ]
+        assert second_call_kwargs["tool_choice"] == {"type": "auto"}
+        # Caller's tool definitions are not mutated by the cache marker
+        assert "cache_control" not in SEARCH_TOOL_DEFS[0]
+
+    async def test_max_rounds_limit(
+        self,
+        anthropic_client,
+        setup_generator,
+        mock_tool_use_response,
+        mock_text_response,
+    ):
         """Test that loop exits after MAX_ROUNDS (2) even if Claude keeps requesting tools."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            # Claude keeps requesting tools indefinitely
-            mock_client.messages.create.side_effect = [
+        # Claude keeps requesting tools indefinitely
+        generator, tool_manager = setup_generator(
+            [
                 mock_tool_use_response(tool_id="toolu_1"),
                 mock_tool_use_response(tool_id="toolu_2"),
                 mock_tool_use_response(
                     tool_id="toolu_3"
                 ),  # Would be 3rd round, but won't be reached
-            ]
-            mock_anthropic.return_value = mock_client
-
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(return_value="Tool result")
-
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            # Should not raise, should return after 2 rounds
-            response = generator.generate_response(
-                query="Test query", tools=[], tool_manager=tool_manager
-            )
-
-            # Should have made exactly 3 API calls (initial + 2 rounds)
-            assert mock_client.messages.create.call_count == 3
-            # Tool manager should have been called twice (once per round)
-            assert tool_manager.execute_tool.call_count == 2
-
-    def test_tool_execution_error_handling(
-        self, mock_tool_use_response, mock_text_response
+            ],
+            "Tool result",
+        )
+
+        # Should not raise, should return after 2 rounds
+        response = await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
+
+        # Should have made exactly 3 API calls (initial + 2 rounds)
+        assert anthropic_client.messages.create.call_count == 3
+        # Tool manager should have been called twice (once per round)
+        assert tool_manager.execute_tool.call_count == 2
+
+    async def test_final_round_forces_text_response(
+        self,
+        anthropic_client,
+        setup_generator,
+    ):
+        """Test that the last follow-up call disallows further tool use."""
+        generator, tool_manager = setup_generator(
+            list(_SEQ_TWO_TOOLS_THEN_TEXT), "Tool result"
+        )
+
+        response = await generator.generate_response(
+            query="Test query", tools=SEARCH_TOOL_DEFS, tool_manager=tool_manager
+        )
+
+        calls = anthropic_client.messages.create.call_args_list
+        # Intermediate follow-up may still call tools
+        assert calls[1].kwargs["tool_choice"] == {"type": "auto"}
+        # Final follow-up keeps tool schemas but forbids tool use
+        assert calls[2].kwargs["tool_choice"] == {"type": "none"}
+        assert "tools" in calls[2].kwargs
+        assert response == "Final answer"
+
+    async def test_tool_execution_error_handling(
+        self,
+        anthropic_client,
+        setup_generator,
+        mock_tool_use_response,
+        mock_text_response,
     ):
         """Test that tool execution errors are handled gracefully."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.side_effect = [
+        generator, tool_manager = setup_generator(
+            [
                 mock_tool_use_response(tool_id="toolu_1"),
                 mock_text_response("I encountered an error with the tool"),
-            ]
-            mock_anthropic.return_value = mock_client
+            ],
+            Exception("Database connection failed"),
+        )
+
+        response = await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
+
+        # Should still return a response
+        assert "error" in response.lower()
+
+        # Verify error was passed in tool result
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        messages = second_call_kwargs["messages"]
+        tool_result = messages[2]["content"][0]
+        assert tool_result["is_error"] is True
+        assert "Database connection failed" in tool_result["content"]
+
+    async def test_early_exit_on_non_tool_response(
+        self,
+        anthropic_client,
+        setup_generator,
+    ):
+        """Test that loop exits early when Claude responds without tool_use."""
+        # First round: tool_use, then Claude responds with text (no more tools needed)
+        generator, tool_manager = setup_generator(
+            list(_SEQ_TOOL_THEN_TEXT), "Tool result"
+        )
 
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(
-                side_effect=Exception("Database connection failed")
-            )
+        response = await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
 
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(
-                query="Test query", tools=[], tool_manager=tool_manager
-            )
+        # Should have made exactly 2 API calls
+        assert anthropic_client.messages.create.call_count == 2
+        assert response == "Final answer"
+
+    async def test_tool_use_stop_without_tool_blocks(
+        self, anthropic_client, generator, tool_manager
+    ):
+        """Test that a tool_use stop with no tool_use blocks ends the turn."""
+
+        response = SimpleNamespace(
+            stop_reason="tool_use",
+            content=[SimpleNamespace(type="text", text="Answer without tools")],
+        )
+
+        anthropic_client.messages.create.return_value = response
+
+        result = await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
+
+        assert result == "Answer without tools"
+        assert anthropic_client.messages.create.call_count == 1
+        tool_manager.execute_tool.assert_not_called()
 
-            # Should still return a response
-            assert "error" in response.lower()
 
-            # Verify error was passed in tool result
-            second_call_kwargs = mock_client.messages.create.call_args_list[1][1]
-            messages = second_call_kwargs["messages"]
-            tool_result = messages[2]["content"][0]
-            assert tool_result["is_error"] is True
-            assert "Database connection failed" in tool_result["content"]
+class TestAIGeneratorParallelToolExecution:
+    """Tests for concurrent execution of multiple tool calls in one round."""
 
-    def test_early_exit_on_non_tool_response(
-        self, mock_tool_use_response, mock_text_response
+    async def test_multiple_tool_calls_results_keep_order(
+        self, anthropic_client, setup_generator, mock_text_response
     ):
-        """Test that loop exits early when Claude responds without tool_use."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            # First round: tool_use, then Claude responds with text (no more tools needed)
-            mock_client.messages.create.side_effect = [
-                mock_tool_use_response(tool_id="toolu_1"),
-                mock_text_response("Answer after single tool use"),
-            ]
-            mock_anthropic.return_value = mock_client
+        """Test that parallel tool results are correlated to their tool_use ids."""
+
+        tool_response = SimpleNamespace(
+            stop_reason="tool_use",
+            content=[
+                SimpleNamespace(
+                    type="tool_use",
+                    id=tool_id,
+                    name="search_course_content",
+                    input={"query": query},
+                )
+                for tool_id, query in [("toolu_a", "first"), ("toolu_b", "second")]
+            ],
+        )
+
+        generator, tool_manager = setup_generator(
+            [
+                tool_response,
+                mock_text_response("Combined answer"),
+            ],
+            lambda name, query: f"Result for {query}",
+        )
+
+        await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
+
+        assert tool_manager.execute_tool.call_count == 2
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        tool_results = second_call_kwargs["messages"][2]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["toolu_a", "toolu_b"]
+        assert [r["content"] for r in tool_results] == [
+            "Result for first",
+            "Result for second",
+        ]
+
+    async def test_single_failure_does_not_affect_other_results(
+        self, anthropic_client, setup_generator, mock_text_response
+    ):
+        """Test that one failing tool call yields an is_error result only for itself."""
+
+        tool_response = SimpleNamespace(
+            stop_reason="tool_use",
+            content=[
+                SimpleNamespace(
+                    type="tool_use",
+                    id=tool_id,
+                    name="search_course_content",
+                    input={"query": query},
+                )
+                for tool_id, query in [("toolu_a", "ok"), ("toolu_b", "fail")]
+            ],
+        )
 
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(return_value="Tool result")
+        def execute_tool(name, query):
+            if query == "fail":
+                raise Exception("Search backend unavailable")
+            return "Good result"
 
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            response = generator.generate_response(
-                query="Test query", tools=[], tool_manager=tool_manager
+        generator, tool_manager = setup_generator(
+            [
+                tool_response,
+                mock_text_response("Partial answer"),
+            ],
+            execute_tool,
+        )
+
+        await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
+
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        tool_results = second_call_kwargs["messages"][2]["content"]
+        assert tool_results[0]["content"] == "Good result"
+        assert "is_error" not in tool_results[0]
+        assert tool_results[1]["is_error"] is True
+        assert "Search backend unavailable" in tool_results[1]["content"]
+
+    async def test_identical_tool_calls_executed_once(
+        self, anthropic_client, setup_generator, mock_text_response
+    ):
+        """Test that duplicate tool calls share one execution across tool_use ids."""
+
+        tool_response = SimpleNamespace(
+            stop_reason="tool_use",
+            content=[
+                SimpleNamespace(
+                    type="tool_use",
+                    id=tool_id,
+                    name="get_course_outline",
+                    input={"course_title": "MCP"},
+                )
+                for tool_id in ["toolu_a", "toolu_b"]
+            ],
+        )
+
+        generator, tool_manager = setup_generator(
+            [
+                tool_response,
+                mock_text_response("Outline answer"),
+            ],
+            "MCP outline",
+        )
+
+        await generator.generate_response(
+            query="Test query", tools=[], tool_manager=tool_manager
+        )
+
+        tool_manager.execute_tool.assert_called_once_with(
+            "get_course_outline", course_title="MCP"
+        )
+        second_call_kwargs = anthropic_client.messages.create.call_args_list[1].kwargs
+        tool_results = second_call_kwargs["messages"][2]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["toolu_a", "toolu_b"]
+        assert all(r["content"] == "MCP outline" for r in tool_results)
+
+
+class _FakeStream:
+    """Stands in for the SDK's message stream: yields events, then a final message."""
+
+    def __init__(self, events, final_message):
+        self.events = events
+        self.get_final_message = AsyncMock(return_value=final_message)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def __aiter__(self):
+        for event in self.events:
+            yield event
+
+
+def _text_event(text):
+    return SimpleNamespace(type="text", text=text)
+
+
+def _tool_stop_event(tool_block):
+    return SimpleNamespace(type="content_block_stop", content_block=tool_block)
+
+
+class TestAIGeneratorStreaming:
+    """Tests for streamed responses."""
+
+    async def test_stream_yields_text_chunks(
+        self, anthropic_client, generator, mock_text_response
+    ):
+        """Test that text deltas are yielded as they arrive."""
+        anthropic_client.messages.stream = Mock(
+            return_value=_FakeStream(
+                [_text_event("Hello, "), _text_event("world")],
+                mock_text_response("Hello, world"),
             )
+        )
 
-            # Should have made exactly 2 API calls
-            assert mock_client.messages.create.call_count == 2
-            assert response == "Answer after single tool use"
+        chunks = [chunk async for chunk in generator.stream_response("Hi")]
 
-    def test_message_accumulation_across_rounds(
-        self, mock_tool_use_response, mock_text_response
+        assert chunks == ["Hello, ", "world"]
+        anthropic_client.messages.stream.assert_called_once()
+
+    async def test_stream_executes_tool_and_streams_follow_up(
+        self,
+        anthropic_client,
+        generator,
+        mock_tool_use_response,
+        mock_text_response,
+        tool_manager,
     ):
-        """Test that messages accumulate correctly across multiple rounds."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_client = Mock()
-            mock_client.messages.create.side_effect = [
-                mock_tool_use_response(
-                    tool_name="get_course_outline",
-                    tool_input={"course_title": "Course A"},
-                    tool_id="toolu_1",
-                ),
-                mock_tool_use_response(
-                    tool_name="search_course_content",
-                    tool_input={"query": "topic B"},
-                    tool_id="toolu_2",
+        """Test that a completed tool_use block is executed and the answer streamed."""
+        tool_response = mock_tool_use_response(
+            tool_name="search_course_content",
+            tool_input={"query": "MCP"},
+            tool_id="toolu_1",
+        )
+        first_stream = _FakeStream(
+            [_tool_stop_event(tool_response.content[0])], tool_response
+        )
+        anthropic_client.messages.stream = Mock(
+            side_effect=[
+                first_stream,
+                _FakeStream(
+                    [_text_event("MCP answer")], mock_text_response("MCP answer")
                 ),
-                mock_text_response("Final combined answer"),
             ]
-            mock_anthropic.return_value = mock_client
+        )
 
-            tool_manager = Mock()
-            tool_manager.execute_tool = Mock(
-                side_effect=["Outline result", "Search result"]
-            )
+        tool_manager.execute_tool.return_value = "MCP content"
 
-            generator = AIGenerator(api_key="test-key", model="test-model")
-            generator.generate_response(
-                query="Original query", tools=[], tool_manager=tool_manager
+        chunks = [
+            chunk
+            async for chunk in generator.stream_response(
+                "What is MCP?", tools=[{"name": "t"}], tool_manager=tool_manager
+            )
+        ]
+
+        assert chunks == ["MCP answer"]
+        tool_manager.execute_tool.assert_called_once_with(
+            "search_course_content", query="MCP"
+        )
+        second_call_kwargs = anthropic_client.messages.stream.call_args_list[1].kwargs
+        tool_result = second_call_kwargs["messages"][2]["content"][0]
+        assert tool_result["tool_use_id"] == "toolu_1"
+        assert tool_result["content"] == "MCP content"
+
+    async def test_stream_two_tool_rounds_then_final_answer(
+        self,
+        anthropic_client,
+        generator,
+        mock_tool_use_response,
+        mock_text_response,
+        tool_manager,
+    ):
+        """Test two tool rounds, the forced-text final call and round separators."""
+        outline = mock_tool_use_response(
+            tool_name="get_course_outline",
+            tool_input={"course_title": "MCP"},
+            tool_id="toolu_1",
+        )
+        search = mock_tool_use_response(
+            tool_name="search_course_content",
+            tool_input={"query": "lesson 4"},
+            tool_id="toolu_2",
+        )
+        anthropic_client.messages.stream = Mock(
+            side_effect=[
+                _FakeStream(
+                    [_text_event("Checking."), _tool_stop_event(outline.content[0])],
+                    outline,
+                ),
+                _FakeStream(
+                    [_text_event("Searching."), _tool_stop_event(search.content[0])],
+                    search,
+                ),
+                _FakeStream([_text_event("Answer")], mock_text_response("Answer")),
+            ]
+        )
+        tool_manager.execute_tool.return_value = "Tool output"
+
+        chunks = [
+            chunk
+            async for chunk in generator.stream_response(
+                "What is lesson 4 of MCP?",
+                tools=SEARCH_TOOL_DEFS,
+                tool_manager=tool_manager,
             )
+        ]
 
-            # Check third API call has full message history
-            third_call_kwargs = mock_client.messages.create.call_args_list[2][1]
-            messages = third_call_kwargs["messages"]
+        from ai_generator import ROUND_BREAK
 
-            # Should have: user query, assistant tool_use_1, user tool_result_1,
-            #              assistant tool_use_2, user tool_result_2
-            assert len(messages) == 5
-            assert messages[0]["role"] == "user"  # Original query
-            assert messages[1]["role"] == "assistant"  # First tool_use
-            assert messages[2]["role"] == "user"  # First tool_result
-            assert messages[3]["role"] == "assistant"  # Second tool_use
-            assert messages[4]["role"] == "user"  # Second tool_result
+        # Text from separate rounds is separated by a blank line
+        assert chunks == ["Checking.", "\n\n", "Searching.", "\n\n", "Answer"]
+        assert chunks[1] is chunks[3] is ROUND_BREAK
+        assert tool_manager.execute_tool.call_count == 2
+        calls = anthropic_client.messages.stream.call_args_list
+        assert len(calls) == 3
+        assert calls[1].kwargs["tool_choice"] == {"type": "auto"}
+        # After MAX_TOOL_ROUNDS the final call keeps tools but forces text
+        assert "tools" in calls[2].kwargs
+        assert calls[2].kwargs["tool_choice"] == {"type": "none"}
 
 
 class TestAIGeneratorExtractTextResponse:
     """Tests for _extract_text_response helper method."""
 
-    def test_extract_text_from_response(self, mock_text_response):
+    def test_extract_text_from_response(self, generator, mock_text_response):
         """Test extracting text from a normal response."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_anthropic.return_value = Mock()
-            generator = AIGenerator(api_key="test-key", model="test-model")
 
-            response = mock_text_response("Expected text content")
-            result = generator._extract_text_response(response)
+        response = mock_text_response("Expected text content")
+        result = generator._extract_text_response(response)
 
-            assert result == "Expected text content"
+        assert result == "Expected text content"
 
-    def test_extract_text_returns_empty_for_no_text(self):
+    def test_extract_text_returns_empty_for_no_text(self, generator):
         """Test that empty string is returned when no text block exists."""
-        with patch("anthropic.Anthropic") as mock_anthropic:
-            mock_anthropic.return_value = Mock()
-            generator = AIGenerator(api_key="test-key", model="test-model")
 
-            # Response with only tool_use, no text
-            response = Mock()
-            tool_block = Mock()
-            tool_block.type = "tool_use"
-            # No 'text' attribute
-            del tool_block.text
-            response.content = [tool_block]
+        # Response with only tool_use, no text
+        response = SimpleNamespace(content=[SimpleNamespace(type="tool_use")])
 
-            result = generator._extract_text_response(response)
+        result = generator._extract_text_response(response)
 
-            assert result == ""
+        assert result == ""
@@ -1,16 +1,47 @@
 """Tests for FastAPI endpoints."""
 
+import asyncio
+import json
+
 import pytest
 
+# Fixed query payloads, built once at import
+_LONG_QUERY = "machine learning " * 500
+_UNICODE_QUERY = "机器学习是什么？ 🤖"
+_SPECIAL_QUERY = "What about C++ & Python <script>alert('xss')</script>?"
+
+# Pre-serialized request bodies, sent with content= to skip per-call encoding
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_BODY_ML = json.dumps(
+    {"query": "What is machine learning?", "session_id": "existing-session"}
+).encode()
+_BODY_NEURAL = json.dumps({"query": "Tell me about neural networks"}).encode()
+_BODY_DEEP_LEARNING = json.dumps(
+    {"query": "What courses cover deep learning?"}
+).encode()
+_BODY_EMPTY_QUERY = json.dumps({"query": ""}).encode()
+_BODY_NO_QUERY = json.dumps({"session_id": "test-session"}).encode()
+_BODY_INVALID = b"not valid json"
+_BODY_ERROR = json.dumps({"query": "This will cause an error"}).encode()
+_BODY_OBSCURE = json.dumps({"query": "Obscure topic with no results"}).encode()
+_BODY_NULL_SESSION = json.dumps({"query": "test query", "session_id": None}).encode()
+_VALIDATION_BODIES = [
+    json.dumps({"query": query}).encode()
+    for query in (
+        _SPECIAL_QUERY,
+        _UNICODE_QUERY,
+        _LONG_QUERY,  # No explicit length limit in the API
+    )
+]
+
 
 class TestQueryEndpoint:
     """Tests for POST /api/query endpoint."""
 
-    def test_query_with_session_id(self, test_client, mock_rag_system):
+    async def test_query_with_session_id(self, async_client, mock_rag_system):
         """Query with existing session ID uses that session."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": "What is machine learning?", "session_id": "existing-session"}
+        response = await async_client.post(
+            "/api/query", content=_BODY_ML, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 200
@@ -22,11 +53,12 @@ class TestQueryEndpoint:
             "What is machine learning?", "existing-session"
         )
 
-    def test_query_without_session_id_creates_new(self, test_client, mock_rag_system):
+    async def test_query_without_session_id_creates_new(
+        self, async_client, mock_rag_system
+    ):
         """Query without session ID creates a new session."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": "Tell me about neural networks"}
+        response = await async_client.post(
+            "/api/query", content=_BODY_NEURAL, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 200
@@ -34,11 +66,10 @@ class TestQueryEndpoint:
         assert data["session_id"] == "test-session-123"
         mock_rag_system.session_manager.create_session.assert_called_once()
 
-    def test_query_returns_sources(self, test_client):
+    async def test_query_returns_sources(self, async_client):
         """Query response includes sources with text and links."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": "What courses cover deep learning?"}
+        response = await async_client.post(
+            "/api/query", content=_BODY_DEEP_LEARNING, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 200
@@ -48,39 +79,36 @@ class TestQueryEndpoint:
         assert "text" in source
         assert "link" in source
 
-    def test_query_empty_string_returns_error(self, test_client):
+    async def test_query_empty_string_returns_error(self, async_client):
         """Empty query string should still process (validation is handled by RAG)."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": ""}
+        response = await async_client.post(
+            "/api/query", content=_BODY_EMPTY_QUERY, headers=_JSON_HEADERS
         )
         # Empty string is valid JSON, the RAG system handles empty queries
         assert response.status_code == 200
 
-    def test_query_missing_query_field(self, test_client):
+    async def test_query_missing_query_field(self, async_client):
         """Missing query field returns 422 validation error."""
-        response = test_client.post(
-            "/api/query",
-            json={"session_id": "test-session"}
+        response = await async_client.post(
+            "/api/query", content=_BODY_NO_QUERY, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 422
 
-    def test_query_invalid_json(self, test_client):
+    async def test_query_invalid_json(self, async_client):
         """Invalid JSON returns 422 error."""
-        response = test_client.post(
+        response = await async_client.post(
             "/api/query",
-            content="not valid json",
-            headers={"Content-Type": "application/json"}
+            content=_BODY_INVALID,
+            headers=_JSON_HEADERS,
         )
 
         assert response.status_code == 422
 
-    def test_query_rag_system_error(self, test_client_error):
+    async def test_query_rag_system_error(self, async_client_error):
         """RAG system error returns 500 with error detail."""
-        response = test_client_error.post(
-            "/api/query",
-            json={"query": "This will cause an error"}
+        response = await async_client_error.post(
+            "/api/query", content=_BODY_ERROR, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 500
@@ -88,11 +116,10 @@ class TestQueryEndpoint:
         assert "detail" in data
         assert "RAG system error" in data["detail"]
 
-    def test_query_empty_sources(self, test_client_empty):
+    async def test_query_empty_sources(self, async_client_empty):
         """Query with no matching content returns empty sources."""
-        response = test_client_empty.post(
-            "/api/query",
-            json={"query": "Obscure topic with no results"}
+        response = await async_client_empty.post(
+            "/api/query", content=_BODY_OBSCURE, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 200
@@ -101,12 +128,71 @@ class TestQueryEndpoint:
         assert "couldn't find" in data["answer"].lower()
 
 
+class TestQueryStreamEndpoint:
+    """Tests for POST /api/query/stream endpoint."""
+
+    @staticmethod
+    def _events(response):
+        """Decode a newline-delimited JSON body into its events."""
+        assert response.text.endswith("\n")
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    async def test_stream_ndjson_events(self, async_client, mock_rag_system):
+        """Stream sends the session, the answer chunks, then the sources."""
+        response = await async_client.post(
+            "/api/query/stream", content=_BODY_ML, headers=_JSON_HEADERS
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert self._events(response) == [
+            {"type": "session", "session_id": "existing-session"},
+            {"type": "text", "text": "This is a test response "},
+            {"type": "text", "text": "about machine learning."},
+            {
+                "type": "sources",
+                "sources": [
+                    {"text": "Source 1: ML basics", "link": "https://example.com/ml"}
+                ],
+            },
+        ]
+        mock_rag_system.query_stream.assert_called_once_with(
+            "What is machine learning?", "existing-session"
+        )
+
+    async def test_stream_without_session_id_creates_new(
+        self, async_client, mock_rag_system
+    ):
+        """Stream without session ID announces a newly created session first."""
+        response = await async_client.post(
+            "/api/query/stream", content=_BODY_NEURAL, headers=_JSON_HEADERS
+        )
+
+        events = self._events(response)
+        assert events[0] == {"type": "session", "session_id": "test-session-123"}
+        mock_rag_system.session_manager.create_session.assert_called_once()
+
+    async def test_stream_error_reported_in_band(self, async_client_error):
+        """Errors after the stream has started arrive as a final error event."""
+        response = await async_client_error.post(
+            "/api/query/stream", content=_BODY_ML, headers=_JSON_HEADERS
+        )
+
+        # Headers were already sent, so the status stays 200
+        assert response.status_code == 200
+        assert self._events(response) == [
+            {"type": "session", "session_id": "existing-session"},
+            {"type": "text", "text": "Partial"},
+            {"type": "error", "detail": "RAG system error"},
+        ]
+
+
 class TestCoursesEndpoint:
     """Tests for GET /api/courses endpoint."""
 
-    def test_get_courses_success(self, test_client):
+    async def test_get_courses_success(self, async_client):
         """Get courses returns course statistics."""
-        response = test_client.get("/api/courses")
+        response = await async_client.get("/api/courses")
 
         assert response.status_code == 200
         data = response.json()
@@ -114,18 +200,18 @@ class TestCoursesEndpoint:
         assert len(data["course_titles"]) == 3
         assert "Course A" in data["course_titles"]
 
-    def test_get_courses_empty(self, test_client_empty):
+    async def test_get_courses_empty(self, async_client_empty):
         """Get courses with no loaded courses returns zeros."""
-        response = test_client_empty.get("/api/courses")
+        response = await async_client_empty.get("/api/courses")
 
         assert response.status_code == 200
         data = response.json()
         assert data["total_courses"] == 0
         assert data["course_titles"] == []
 
-    def test_get_courses_error(self, test_client_error):
+    async def test_get_courses_error(self, async_client_error):
         """Analytics error returns 500."""
-        response = test_client_error.get("/api/courses")
+        response = await async_client_error.get("/api/courses")
 
         assert response.status_code == 500
         data = response.json()
@@ -135,9 +221,9 @@ class TestCoursesEndpoint:
 class TestRootEndpoint:
     """Tests for GET / endpoint."""
 
-    def test_root_returns_status(self, test_client):
+    async def test_root_returns_status(self, async_client):
         """Root endpoint returns status OK."""
-        response = test_client.get("/")
+        response = await async_client.get("/")
 
         assert response.status_code == 200
         data = response.json()
@@ -147,39 +233,21 @@ class TestRootEndpoint:
 class TestRequestValidation:
     """Tests for request validation and edge cases."""
 
-    def test_query_with_special_characters(self, test_client):
-        """Query with special characters is handled properly."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": "What about C++ & Python <script>alert('xss')</script>?"}
+    async def test_query_validation_batch(self, async_client):
+        """Special characters, unicode and very long queries are all accepted."""
+        responses = await asyncio.gather(
+            *(
+                async_client.post("/api/query", content=body, headers=_JSON_HEADERS)
+                for body in _VALIDATION_BODIES
+            )
         )
 
-        assert response.status_code == 200
+        assert [response.status_code for response in responses] == [200] * 3
 
-    def test_query_with_unicode(self, test_client):
-        """Query with unicode characters is handled properly."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": "机器学习是什么？ 🤖"}
-        )
-
-        assert response.status_code == 200
-
-    def test_query_with_very_long_text(self, test_client):
-        """Very long query is handled (no explicit limit in API)."""
-        long_query = "machine learning " * 500
-        response = test_client.post(
-            "/api/query",
-            json={"query": long_query}
-        )
-
-        assert response.status_code == 200
-
-    def test_query_null_session_id(self, test_client, mock_rag_system):
+    async def test_query_null_session_id(self, async_client, mock_rag_system):
         """Null session_id is treated as no session."""
-        response = test_client.post(
-            "/api/query",
-            json={"query": "test query", "session_id": None}
+        response = await async_client.post(
+            "/api/query", content=_BODY_NULL_SESSION, headers=_JSON_HEADERS
         )
 
         assert response.status_code == 200
@@ -1,44 +1,19 @@
 """Integration tests for RAGSystem."""
 
+import asyncio
+import dataclasses
 import pytest
-from unittest.mock import Mock, MagicMock, patch
 
-import sys
-import os
-
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from rag_system import RAGSystem
 from config import Config
 
 
 class TestRAGSystemQuery:
     """Tests for RAGSystem.query() functionality."""
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_query_returns_tuple(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
-    ):
+    async def test_query_returns_tuple(self, configured_rag_system):
         """Test that query() returns (response, sources) tuple."""
-        # Setup mocks
-        mock_ai_instance = Mock()
-        mock_ai_instance.generate_response = Mock(return_value="Test response")
-        mock_ai_gen.return_value = mock_ai_instance
-
-        mock_vs_instance = Mock()
-        mock_vs_instance.search = Mock()
-        mock_vs_instance.get_lesson_link = Mock(return_value=None)
-        mock_vs.return_value = mock_vs_instance
-
-        mock_session_instance = Mock()
-        mock_session_instance.get_conversation_history = Mock(return_value=None)
-        mock_session.return_value = mock_session_instance
-
-        system = RAGSystem(working_config)
-        result = system.query("What is machine learning?")
+        system, _ = configured_rag_system
+        result = await system.query("What is machine learning?")
 
         assert isinstance(result, tuple)
         assert len(result) == 2
@@ -46,196 +21,293 @@ class TestRAGSystemQuery:
         assert isinstance(response, str)
         assert isinstance(sources, list)
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_query_with_session(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
-    ):
+    async def test_query_with_session(self, configured_rag_system):
         """Test query with session ID for conversation context."""
-        mock_ai_instance = Mock()
-        mock_ai_instance.generate_response = Mock(return_value="Response with context")
-        mock_ai_gen.return_value = mock_ai_instance
-
-        mock_vs_instance = Mock()
-        mock_vs.return_value = mock_vs_instance
-
-        mock_session_instance = Mock()
-        mock_session_instance.get_conversation_history = Mock(
-            return_value="Previous conversation"
+        system, mocks = configured_rag_system
+        mocks.session_manager.get_conversation_history.return_value = (
+            "Previous conversation"
         )
-        mock_session.return_value = mock_session_instance
 
-        system = RAGSystem(working_config)
-        system.query("Follow up question", session_id="session123")
+        await system.query("Follow up question", session_id="session123")
 
-        mock_session_instance.get_conversation_history.assert_called_with("session123")
-        mock_session_instance.add_exchange.assert_called()
+        mocks.session_manager.get_conversation_history.assert_called_with("session123")
+        mocks.session_manager.add_exchange.assert_called()
 
 
 class TestRAGSystemSourceManagement:
     """Tests for source retrieval and reset functionality."""
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_sources_retrieved_after_query(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
+    @staticmethod
+    async def _search_then_respond(**kwargs):
+        """Stand-in for generate_response that runs the search tool once."""
+        kwargs["tool_manager"].execute_tool("search_course_content", query="test")
+        return "Response"
+
+    async def test_sources_retrieved_after_query(
+        self, configured_rag_system, populated_search_results
     ):
         """Test that sources are retrieved from tool manager after query."""
-        mock_ai_instance = Mock()
-        mock_ai_instance.generate_response = Mock(return_value="Response")
-        mock_ai_gen.return_value = mock_ai_instance
-
-        mock_vs_instance = Mock()
-        mock_vs_instance.search = Mock()
-        mock_vs_instance.get_lesson_link = Mock(return_value="http://example.com")
-        mock_vs.return_value = mock_vs_instance
-
-        mock_session_instance = Mock()
-        mock_session_instance.get_conversation_history = Mock(return_value=None)
-        mock_session.return_value = mock_session_instance
+        system, mocks = configured_rag_system
+        mocks.ai_generator.generate_response.side_effect = self._search_then_respond
+        mocks.vector_store.search.return_value = populated_search_results
+        mocks.vector_store.get_lesson_link.return_value = "http://example.com"
 
-        system = RAGSystem(working_config)
+        response, sources = await system.query("Test query")
 
-        # Simulate tool having sources
-        system.search_tool.last_sources = [
-            {"text": "Test Course - Lesson 1", "link": "http://example.com"}
-        ]
+        assert len(sources) == 1
+        assert sources[0]["text"] == "Test Course - Lesson 1"
 
-        response, sources = system.query("Test query")
+    async def test_sources_not_carried_into_next_query(
+        self, configured_rag_system, populated_search_results
+    ):
+        """Test that a query without tool calls reports no sources."""
+        system, mocks = configured_rag_system
+        mocks.ai_generator.generate_response.side_effect = self._search_then_respond
+        mocks.vector_store.search.return_value = populated_search_results
+        mocks.vector_store.get_lesson_link.return_value = None
 
+        _, sources = await system.query("Test query")
         assert len(sources) == 1
-        assert sources[0]["text"] == "Test Course - Lesson 1"
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_sources_reset_after_query(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
+        mocks.ai_generator.generate_response.side_effect = None
+        _, sources = await system.query("Another query")
+        assert sources == []
+
+    async def test_concurrent_queries_keep_their_own_sources(
+        self, configured_rag_system
     ):
-        """Test that sources are reset after retrieval."""
-        mock_ai_instance = Mock()
-        mock_ai_instance.generate_response = Mock(return_value="Response")
-        mock_ai_gen.return_value = mock_ai_instance
+        """Test that overlapping queries never report each other's sources."""
+        from vector_store import SearchResults
+
+        system, mocks = configured_rag_system
+        mocks.vector_store.get_lesson_link.return_value = None
+        mocks.vector_store.search.side_effect = lambda query, **kwargs: SearchResults(
+            documents=[f"{query} content"],
+            metadata=[{"course_title": query, "lesson_number": 1}],
+            distances=[0.1],
+        )
+        b_searched = asyncio.Event()
+
+        async def search_then_respond(query, tool_manager, **kwargs):
+            # A searches first but only answers once B has searched too
+            course = query[-1]
+            tool_manager.execute_tool("search_course_content", query=course)
+            if course == "A":
+                await b_searched.wait()
+            else:
+                b_searched.set()
+            return f"Answer {course}"
+
+        mocks.ai_generator.generate_response.side_effect = search_then_respond
+
+        (answer_a, sources_a), (answer_b, sources_b) = await asyncio.gather(
+            system.query("A"), system.query("B")
+        )
 
-        mock_vs_instance = Mock()
-        mock_vs.return_value = mock_vs_instance
+        assert (answer_a, sources_a) == (
+            "Answer A",
+            [{"text": "A - Lesson 1", "link": None}],
+        )
+        assert (answer_b, sources_b) == (
+            "Answer B",
+            [{"text": "B - Lesson 1", "link": None}],
+        )
+        mocks.response_cache.store.assert_any_call("A", "Answer A", sources_a)
 
-        mock_session_instance = Mock()
-        mock_session_instance.get_conversation_history = Mock(return_value=None)
-        mock_session.return_value = mock_session_instance
 
-        system = RAGSystem(working_config)
+class TestRAGSystemResponseCache:
+    """Tests for the semantic response cache in front of the AI generator."""
 
-        # Simulate tool having sources
-        system.search_tool.last_sources = [{"text": "Source", "link": None}]
+    async def test_cache_hit_skips_ai_generator(self, configured_rag_system):
+        """Test that a cached answer is returned without calling Claude."""
+        system, mocks = configured_rag_system
+        cached_sources = [{"text": "ML Course - Lesson 1", "link": None}]
+        mocks.response_cache.lookup.return_value = ("Cached answer", cached_sources)
 
-        system.query("Test query")
+        response, sources = await system.query("What is machine learning?")
 
-        # Sources should be reset
-        assert system.search_tool.last_sources == []
+        assert response == "Cached answer"
+        assert sources == cached_sources
+        mocks.ai_generator.generate_response.assert_not_called()
 
+    async def test_cache_miss_stores_response(self, configured_rag_system):
+        """Test that a freshly generated answer is written to the cache."""
+        system, mocks = configured_rag_system
+        mocks.ai_generator.generate_response.return_value = "Fresh answer"
 
-class TestRAGSystemBugPropagation:
-    """Tests that verify the config bug propagates through the system."""
+        await system.query("What is machine learning?")
 
-    def test_config_max_results_zero(self, broken_config):
-        """Verify broken config has MAX_RESULTS=0."""
-        assert broken_config.MAX_RESULTS == 0
+        mocks.response_cache.store.assert_called_once_with(
+            "What is machine learning?", "Fresh answer", []
+        )
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_vector_store_receives_max_results(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, broken_config
+    async def test_cache_bypassed_with_conversation_history(
+        self, configured_rag_system
     ):
-        """Test that VectorStore is initialized with config's MAX_RESULTS."""
-        mock_vs_instance = Mock()
-        mock_vs.return_value = mock_vs_instance
-        mock_ai_gen.return_value = Mock()
-        mock_session.return_value = Mock()
+        """Test that follow-up questions never read from or write to the cache."""
+        system, mocks = configured_rag_system
+        mocks.ai_generator.generate_response.return_value = "Contextual answer"
+        mocks.session_manager.get_conversation_history.return_value = (
+            "User: What is ML?\nAssistant: ML is..."
+        )
 
-        system = RAGSystem(broken_config)
+        response, _ = await system.query("Tell me more", session_id="session123")
 
-        # VectorStore should be called with MAX_RESULTS from config
-        mock_vs.assert_called_once()
-        call_args = mock_vs.call_args
-        # Third argument is max_results
-        assert (
-            call_args[0][2] == 0
-        ), "VectorStore should receive MAX_RESULTS=0 from broken config"
-
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_working_config_passes_correct_max_results(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
+        assert response == "Contextual answer"
+        mocks.response_cache.lookup.assert_not_called()
+        mocks.response_cache.store.assert_not_called()
+
+    async def test_answer_not_cached_after_tool_error(self, configured_rag_system):
+        """Test that an answer produced despite a failed tool call is not cached."""
+        system, mocks = configured_rag_system
+        mocks.vector_store.search.side_effect = Exception("Database connection failed")
+
+        async def search_then_respond(tool_manager, **kwargs):
+            # AIGenerator reports a raising tool to Claude as an is_error result
+            with pytest.raises(Exception):
+                tool_manager.execute_tool("search_course_content", query="test")
+            return "Sorry, the search failed."
+
+        mocks.ai_generator.generate_response.side_effect = search_then_respond
+
+        response, _ = await system.query("What is machine learning?")
+
+        assert response == "Sorry, the search failed."
+        mocks.response_cache.store.assert_not_called()
+
+    def test_cache_version_follows_model(
+        self, rag_system_cls, rag_mocks, working_config
     ):
-        """Test that working config passes correct MAX_RESULTS to VectorStore."""
-        mock_vs_instance = Mock()
-        mock_vs.return_value = mock_vs_instance
-        mock_ai_gen.return_value = Mock()
-        mock_session.return_value = Mock()
+        """Test that cached answers are versioned by the model they came from."""
+        other_model = dataclasses.replace(working_config, ANTHROPIC_MODEL="other")
+        versions = []
+        for config in (working_config, working_config, other_model):
+            rag_system_cls(config)
+            versions.append(rag_mocks["SemanticCache"].call_args.args[3])
 
-        system = RAGSystem(working_config)
+        assert versions[0] == versions[1]
+        assert versions[0] != versions[2]
 
-        mock_vs.assert_called_once()
-        call_args = mock_vs.call_args
-        # Third argument is max_results
-        assert (
-            call_args[0][2] == 5
-        ), "VectorStore should receive MAX_RESULTS=5 from working config"
 
+class TestRAGSystemStreaming:
+    """Tests for streamed query processing."""
 
-class TestRAGSystemToolIntegration:
-    """Tests for tool manager integration."""
+    async def test_query_stream_yields_text_then_sources(self, configured_rag_system):
+        """Test that answer chunks are streamed, then the sources, then cached."""
+
+        async def fake_stream(**kwargs):
+            for chunk in ("Machine learning ", "is a field of AI."):
+                yield chunk
+
+        system, mocks = configured_rag_system
+        mocks.ai_generator.stream_response.side_effect = fake_stream
+
+        events = [event async for event in system.query_stream("What is ML?")]
+
+        assert events == [
+            {"type": "text", "text": "Machine learning "},
+            {"type": "text", "text": "is a field of AI."},
+            {"type": "sources", "sources": []},
+        ]
+        mocks.response_cache.store.assert_called_once_with(
+            "What is ML?", "Machine learning is a field of AI.", []
+        )
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_tools_registered_on_init(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
+    async def test_query_stream_caches_final_round_only(self, configured_rag_system):
+        """Test that tool-round narration is streamed but not cached or recorded."""
+        from ai_generator import ROUND_BREAK
+
+        async def narrate_then_answer(**kwargs):
+            for chunk in ("Let me search.", ROUND_BREAK, "ML is ", "a field of AI."):
+                yield chunk
+
+        system, mocks = configured_rag_system
+        mocks.ai_generator.stream_response.side_effect = narrate_then_answer
+
+        events = [e async for e in system.query_stream("What is ML?", "session1")]
+
+        assert [e["text"] for e in events[:-1]] == [
+            "Let me search.",
+            "\n\n",
+            "ML is ",
+            "a field of AI.",
+        ]
+        mocks.response_cache.store.assert_called_once_with(
+            "What is ML?", "ML is a field of AI.", []
+        )
+        mocks.session_manager.add_exchange.assert_called_once_with(
+            "session1", "What is ML?", "ML is a field of AI."
+        )
+
+    async def test_disconnect_mid_stream(
+        self, configured_rag_system, populated_search_results
     ):
-        """Test that search tools are registered during initialization."""
-        mock_vs.return_value = Mock()
-        mock_ai_gen.return_value = Mock()
-        mock_session.return_value = Mock()
+        """Test that an aborted stream is closed and leaves nothing behind."""
+        closed = []
 
-        system = RAGSystem(working_config)
+        async def search_then_stream(tool_manager, **kwargs):
+            tool_manager.execute_tool("search_course_content", query="test")
+            try:
+                yield "Partial "
+                yield "answer"
+            finally:
+                closed.append(True)
 
-        assert "search_course_content" in system.tool_manager.tools
-        assert "get_course_outline" in system.tool_manager.tools
+        system, mocks = configured_rag_system
+        mocks.vector_store.search.return_value = populated_search_results
+        mocks.ai_generator.stream_response.side_effect = search_then_stream
 
-    @patch("rag_system.VectorStore")
-    @patch("rag_system.AIGenerator")
-    @patch("rag_system.DocumentProcessor")
-    @patch("rag_system.SessionManager")
-    def test_tools_passed_to_ai_generator(
-        self, mock_session, mock_doc_proc, mock_ai_gen, mock_vs, working_config
+        events = system.query_stream("What is ML?", session_id="session1")
+        assert await anext(events) == {"type": "text", "text": "Partial "}
+        await events.aclose()
+
+        assert closed == [True]
+        mocks.response_cache.store.assert_not_called()
+        mocks.session_manager.add_exchange.assert_not_called()
+
+        # The aborted stream's sources do not reach the next query
+        _, sources = await system.query("Another query")
+        assert sources == []
+
+
+class TestRAGSystemBugPropagation:
+    """Tests that verify the config bug propagates through the system."""
+
+    @pytest.mark.parametrize(
+        "config_fixture, expected",
+        [("working_config", 5), ("broken_config", 0)],
+    )
+    def test_max_results_flows_to_vector_store(
+        self, request, rag_system_cls, rag_mocks, config_fixture, expected
     ):
-        """Test that tool definitions are passed to AI generator."""
-        mock_ai_instance = Mock()
-        mock_ai_instance.generate_response = Mock(return_value="Response")
-        mock_ai_gen.return_value = mock_ai_instance
+        """Test that VectorStore is initialized with config's MAX_RESULTS."""
+        config = request.getfixturevalue(config_fixture)
+        assert config.MAX_RESULTS == expected
 
-        mock_vs.return_value = Mock()
+        rag_system_cls(config)
+
+        mock_vs = rag_mocks["VectorStore"]
+        assert mock_vs.call_count == 1
+        # Third argument is max_results
+        assert (
+            mock_vs.call_args.args[2] == expected
+        ), f"VectorStore should receive MAX_RESULTS={expected} from {config_fixture}"
 
-        mock_session_instance = Mock()
-        mock_session_instance.get_conversation_history = Mock(return_value=None)
-        mock_session.return_value = mock_session_instance
 
-        system = RAGSystem(working_config)
-        system.query("Test query")
+class TestRAGSystemToolIntegration:
+    """Tests for tool manager integration."""
+
+    def test_tools_registered_on_init(self, shared_rag_system):
+        """Test that search tools are registered during initialization."""
+        assert "search_course_content" in shared_rag_system.tool_manager.tools
+        assert "get_course_outline" in shared_rag_system.tool_manager.tools
+
+    async def test_tools_passed_to_ai_generator(self, shared_rag_system):
+        """Test that tool definitions are passed to AI generator."""
+        await shared_rag_system.query("Test query")
 
         # Check that generate_response was called with tools
-        call_kwargs = mock_ai_instance.generate_response.call_args[1]
+        call_kwargs = shared_rag_system.ai_generator.generate_response.call_args.kwargs
         assert "tools" in call_kwargs
         assert call_kwargs["tools"] is not None
         assert "tool_manager" in call_kwargs
@@ -1,23 +1,24 @@
 """Tests for CourseSearchTool and ToolManager."""
 
+import json
 import pytest
 from unittest.mock import Mock, MagicMock
 
-import sys
-import os
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+@pytest.fixture(scope="session")
+def search_tools():
+    """The search_tools module, imported on first use instead of at collection."""
+    import search_tools
 
-from search_tools import CourseSearchTool, ToolManager
-from vector_store import SearchResults
+    return search_tools
 
 
 class TestCourseSearchTool:
     """Tests for CourseSearchTool functionality."""
 
-    def test_execute_with_empty_results(self, mock_vector_store_empty):
+    def test_execute_with_empty_results(self, mock_vector_store_empty, search_tools):
         """Test execute() returns appropriate message when no results found."""
-        tool = CourseSearchTool(mock_vector_store_empty)
+        tool = search_tools.CourseSearchTool(mock_vector_store_empty)
 
         result = tool.execute(query="machine learning")
 
@@ -26,31 +27,32 @@ class TestCourseSearchTool:
             query="machine learning", course_name=None, lesson_number=None
         )
 
-    def test_execute_with_valid_results(self, mock_vector_store):
-        """Test execute() returns formatted results with source tracking."""
-        tool = CourseSearchTool(mock_vector_store)
+    def test_execute_with_valid_results(self, mock_vector_store, search_tools):
+        """Test run() returns formatted results and their sources."""
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
-        result = tool.execute(query="neural networks")
+        result, sources = tool.run(query="neural networks")
 
         assert "[Test Course - Lesson 1]" in result
         assert "Sample document content" in result
-        assert len(tool.last_sources) == 1
-        assert tool.last_sources[0]["text"] == "Test Course - Lesson 1"
+        assert len(sources) == 1
+        assert sources[0]["text"] == "Test Course - Lesson 1"
+        assert tool.execute(query="neural networks") == result
 
-    def test_execute_with_error(self, mock_vector_store):
+    def test_execute_with_error(
+        self, mock_vector_store, db_error_search_results, search_tools
+    ):
         """Test execute() handles errors properly."""
-        mock_vector_store.search.return_value = SearchResults.empty(
-            "Database connection failed"
-        )
-        tool = CourseSearchTool(mock_vector_store)
+        mock_vector_store.search.return_value = db_error_search_results
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
         result = tool.execute(query="test query")
 
         assert result == "Database connection failed"
 
-    def test_execute_with_course_filter(self, mock_vector_store):
+    def test_execute_with_course_filter(self, mock_vector_store, search_tools):
         """Test execute() passes course filter correctly."""
-        tool = CourseSearchTool(mock_vector_store)
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
         tool.execute(query="test", course_name="ML Course")
 
@@ -58,9 +60,9 @@ class TestCourseSearchTool:
             query="test", course_name="ML Course", lesson_number=None
         )
 
-    def test_execute_with_lesson_filter(self, mock_vector_store):
+    def test_execute_with_lesson_filter(self, mock_vector_store, search_tools):
         """Test execute() passes lesson filter correctly."""
-        tool = CourseSearchTool(mock_vector_store)
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
         tool.execute(query="test", lesson_number=3)
 
@@ -68,9 +70,9 @@ class TestCourseSearchTool:
             query="test", course_name=None, lesson_number=3
         )
 
-    def test_execute_with_both_filters(self, mock_vector_store):
+    def test_execute_with_both_filters(self, mock_vector_store, search_tools):
         """Test execute() passes both filters correctly."""
-        tool = CourseSearchTool(mock_vector_store)
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
         tool.execute(query="test", course_name="ML Course", lesson_number=2)
 
@@ -78,9 +80,9 @@ class TestCourseSearchTool:
             query="test", course_name="ML Course", lesson_number=2
         )
 
-    def test_tool_definition_schema(self, mock_vector_store):
+    def test_tool_definition_schema(self, search_tool_manager):
         """Test get_tool_definition() returns correct schema."""
-        tool = CourseSearchTool(mock_vector_store)
+        _, tool = search_tool_manager
 
         definition = tool.get_tool_definition()
 
@@ -92,105 +94,259 @@ class TestCourseSearchTool:
         assert "lesson_number" in definition["input_schema"]["properties"]
         assert definition["input_schema"]["required"] == ["query"]
 
-    def test_source_tracking_includes_links(self, mock_vector_store):
+    def test_tool_definition_is_shared_constant(self, mock_vector_store, search_tools):
+        """Test get_tool_definition() returns the class-level definition."""
+        tool = search_tools.CourseSearchTool(mock_vector_store)
+        other = search_tools.CourseSearchTool(mock_vector_store)
+
+        assert tool.get_tool_definition() is other.get_tool_definition()
+        assert tool.get_tool_definition() is search_tools.CourseSearchTool._DEFINITION
+
+    def test_source_tracking_includes_links(self, mock_vector_store, search_tools):
         """Test that sources include lesson links when available."""
-        tool = CourseSearchTool(mock_vector_store)
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
-        tool.execute(query="test")
+        _, sources = tool.run(query="test")
 
-        assert len(tool.last_sources) == 1
-        assert "link" in tool.last_sources[0]
+        assert len(sources) == 1
+        assert "link" in sources[0]
         mock_vector_store.get_lesson_link.assert_called()
 
+    def test_lesson_link_looked_up_once_per_lesson(
+        self, mock_vector_store, search_tools
+    ):
+        """Test that chunks from the same lesson share one link lookup."""
+        from vector_store import SearchResults
+
+        mock_vector_store.search.return_value = SearchResults(
+            documents=["Chunk A", "Chunk B", "Chunk C"],
+            metadata=[
+                {"course_title": "Test Course", "lesson_number": 1},
+                {"course_title": "Test Course", "lesson_number": 1},
+                {"course_title": "Test Course", "lesson_number": 2},
+            ],
+            distances=[0.1, 0.2, 0.3],
+        )
+        tool = search_tools.CourseSearchTool(mock_vector_store)
+
+        result, sources = tool.run(query="test")
+
+        assert mock_vector_store.get_lesson_link.call_count == 2
+        assert "[Test Course - Lesson 1]\nChunk B" in result
+        assert [s["text"] for s in sources] == [
+            "Test Course - Lesson 1",
+            "Test Course - Lesson 1",
+            "Test Course - Lesson 2",
+        ]
+
+
+class TestCourseOutlineTool:
+    """Tests for CourseOutlineTool lookups and caching."""
+
+    @pytest.fixture
+    def catalog_store(self, mock_vector_store):
+        """Vector store whose catalog resolves any name to one course."""
+        mock_vector_store.course_catalog.query.return_value = {
+            "documents": [["MCP Course"]],
+            "metadatas": [[{"title": "MCP Course"}]],
+        }
+        mock_vector_store.course_catalog.get.return_value = {
+            "metadatas": [
+                {
+                    "course_link": "https://example.com/mcp",
+                    "lessons_json": json.dumps(
+                        [
+                            {"lesson_number": 0, "lesson_title": "Introduction"},
+                            {"lesson_number": 1, "lesson_title": "Architecture"},
+                        ]
+                    ),
+                }
+            ]
+        }
+        return mock_vector_store
+
+    def test_execute_formats_outline(self, catalog_store, search_tools):
+        """Test run() returns the course outline and its source."""
+        tool = search_tools.CourseOutlineTool(catalog_store)
+
+        result, sources = tool.run(course_title="MCP")
+
+        assert "Course Title: MCP Course" in result
+        assert "Course Link: https://example.com/mcp" in result
+        assert "Lesson 1: Architecture" in result
+        assert sources == [{"text": "MCP Course", "link": "https://example.com/mcp"}]
+
+    def test_repeated_lookups_hit_cache(self, catalog_store, search_tools):
+        """Test that repeat outline requests do not re-query the catalog."""
+        tool = search_tools.CourseOutlineTool(catalog_store)
+
+        first = tool.execute(course_title="MCP")
+        second = tool.execute(course_title="MCP")
+
+        assert first == second
+        assert catalog_store.course_catalog.query.call_count == 1
+        assert catalog_store.course_catalog.get.call_count == 1
+
+    def test_clear_cache_forces_fresh_lookup(self, catalog_store, search_tools):
+        """Test that clear_cache() makes the next call hit the catalog again."""
+        tool = search_tools.CourseOutlineTool(catalog_store)
+
+        tool.execute(course_title="MCP")
+        tool.clear_cache()
+        tool.execute(course_title="MCP")
+
+        assert catalog_store.course_catalog.query.call_count == 2
+        assert catalog_store.course_catalog.get.call_count == 2
+
+    def test_resolution_errors_not_cached(self, catalog_store, search_tools):
+        """Test that a failed catalog query is retried on the next call."""
+        tool = search_tools.CourseOutlineTool(catalog_store)
+        catalog_store.course_catalog.query.side_effect = [
+            Exception("Catalog unavailable"),
+            catalog_store.course_catalog.query.return_value,
+        ]
+
+        assert "No course found" in tool.execute(course_title="MCP")
+        assert "Course Title: MCP Course" in tool.execute(course_title="MCP")
+
+
+@pytest.fixture(scope="module")
+def search_tool_manager(mock_vector_store_module, search_tools):
+    """ToolManager with one CourseSearchTool, shared across the module.
+
+    Tests must not register further tools.
+    """
+    manager = search_tools.ToolManager()
+    tool = search_tools.CourseSearchTool(mock_vector_store_module)
+    manager.register_tool(tool)
+    return manager, tool
+
 
 class TestToolManager:
     """Tests for ToolManager functionality."""
 
-    def test_register_tool(self, mock_vector_store):
+    def test_register_tool(self, mock_vector_store, search_tools):
         """Test registering a tool."""
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
+        manager = search_tools.ToolManager()
+        tool = search_tools.CourseSearchTool(mock_vector_store)
 
         manager.register_tool(tool)
 
         assert "search_course_content" in manager.tools
 
-    def test_get_tool_definitions(self, mock_vector_store):
+    def test_get_tool_definitions(self, search_tool_manager):
         """Test getting all tool definitions."""
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
+        manager, _ = search_tool_manager
 
         definitions = manager.get_tool_definitions()
 
         assert len(definitions) == 1
         assert definitions[0]["name"] == "search_course_content"
 
-    def test_execute_tool(self, mock_vector_store):
-        """Test executing a tool by name."""
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
+    def test_get_tool_definitions_cached(self, mock_vector_store, search_tools):
+        """Test that definitions are built on register, not on every call."""
+        manager = search_tools.ToolManager()
+        manager.register_tool(search_tools.CourseSearchTool(mock_vector_store))
 
-        result = manager.execute_tool("search_course_content", query="test")
+        first = manager.get_tool_definitions()
+        second = manager.get_tool_definitions()
+        assert first is second
+
+        # Registering another tool refreshes the cached definitions
+        manager.register_tool(search_tools.CourseOutlineTool(mock_vector_store))
+        names = [d["name"] for d in manager.get_tool_definitions()]
+        assert names == ["search_course_content", "get_course_outline"]
+
+    def test_execute_tool(self, search_tool_manager):
+        """Test executing a tool by name through a request."""
+        manager, _ = search_tool_manager
+
+        result = manager.for_request().execute_tool(
+            "search_course_content", query="test"
+        )
 
         assert "Test Course" in result or "Sample" in result
 
-    def test_execute_unknown_tool(self):
-        """Test executing an unknown tool returns error."""
-        manager = ToolManager()
 
-        result = manager.execute_tool("unknown_tool", query="test")
+class TestRequestTools:
+    """Tests for per-query tool access via ToolManager.for_request()."""
 
-        assert "not found" in result.lower()
+    def test_sources_kept_per_request(self, search_tool_manager):
+        """Test that each request sees only its own sources."""
+        manager, _ = search_tool_manager
+        first = manager.for_request()
+        second = manager.for_request()
 
-    def test_get_last_sources(self, mock_vector_store):
-        """Test retrieving sources from last tool execution."""
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
+        first.execute_tool("search_course_content", query="test")
 
-        manager.execute_tool("search_course_content", query="test")
-        sources = manager.get_last_sources()
+        assert len(first.get_sources()) == 1
+        assert second.get_sources() == []
 
-        assert len(sources) >= 1
+    def test_sources_from_every_call_in_order(self, mock_vector_store, search_tools):
+        """Test that sources from all of a request's calls are kept in order."""
+        from vector_store import SearchResults
 
-    def test_reset_sources(self, mock_vector_store):
-        """Test resetting sources after retrieval."""
-        manager = ToolManager()
-        tool = CourseSearchTool(mock_vector_store)
-        manager.register_tool(tool)
+        manager = search_tools.ToolManager()
+        manager.register_tool(search_tools.CourseSearchTool(mock_vector_store))
+        mock_vector_store.search.side_effect = lambda query, **kwargs: SearchResults(
+            documents=["Content"],
+            metadata=[{"course_title": query, "lesson_number": 1}],
+            distances=[0.1],
+        )
+        request = manager.for_request()
 
-        manager.execute_tool("search_course_content", query="test")
-        manager.reset_sources()
+        request.execute_tool("search_course_content", query="First")
+        request.execute_tool("search_course_content", query="Second")
 
-        assert tool.last_sources == []
+        assert [s["text"] for s in request.get_sources()] == [
+            "First - Lesson 1",
+            "Second - Lesson 1",
+        ]
 
+    def test_unknown_tool(self, search_tool_manager):
+        """Test that an unknown tool reports an error and records no sources."""
+        manager, _ = search_tool_manager
+        request = manager.for_request()
 
-class TestBugDetection:
-    """Tests that detect the MAX_RESULTS=0 bug."""
+        result = request.execute_tool("nonexistent_tool")
+
+        assert "not found" in result
+        assert request.get_sources() == []
+
+    def test_dispatches_to_latest_registration(self, search_tools):
+        """Test that re-registering a name swaps the tool open requests call."""
+
+        class _EchoTool(search_tools.Tool):
+            def __init__(self, reply):
+                self.reply = reply
+
+            def get_tool_definition(self):
+                return {"name": "echo"}
+
+            def execute(self, **kwargs):
+                return self.reply
 
-    def test_max_results_zero_causes_empty_results(self, broken_config):
-        """Verify that MAX_RESULTS=0 in config causes empty search results.
+        manager = search_tools.ToolManager()
+        manager.register_tool(_EchoTool("old"))
+        request = manager.for_request()
+        manager.register_tool(_EchoTool("new"))
 
-        This test demonstrates the bug: when config.MAX_RESULTS is 0,
-        VectorStore.search() requests 0 results from ChromaDB, returning nothing.
-        """
-        assert broken_config.MAX_RESULTS == 0, "Bug condition: MAX_RESULTS should be 0"
+        assert request.execute_tool("echo") == "new"
+        assert request.get_sources() == []  # Default run() reports no sources
 
-    def test_vector_store_uses_config_max_results(self, mock_vector_store_empty):
+
+class TestBugDetection:
+    """Tests that detect the MAX_RESULTS=0 bug."""
+
+    def test_vector_store_uses_config_max_results(
+        self, mock_vector_store_empty, search_tools
+    ):
         """Test that VectorStore respects max_results setting."""
         # The mock simulates max_results=0 behavior
-        tool = CourseSearchTool(mock_vector_store_empty)
+        tool = search_tools.CourseSearchTool(mock_vector_store_empty)
 
-        result = tool.execute(query="machine learning")
+        result, sources = tool.run(query="machine learning")
 
         # With max_results=0, we get empty results
         assert "No relevant content found" in result
-        assert tool.last_sources == []
-
-    def test_working_config_returns_results(self, working_config):
-        """Verify working config has proper MAX_RESULTS value."""
-        assert (
-            working_config.MAX_RESULTS == 5
-        ), "Working config should have MAX_RESULTS=5"
+        assert sources == []
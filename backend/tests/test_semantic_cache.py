@@ -0,0 +1,185 @@
+"""Tests for SemanticCache against an in-memory ChromaDB client."""
+
+import math
+from types import SimpleNamespace
+
+import pytest
+
+
+def _at_distance(distance):
+    """Unit 2-D vector at the given cosine distance from [1, 0]."""
+    return [1.0 - distance, math.sqrt(1.0 - (1.0 - distance) ** 2)]
+
+
+# Fixed 2-D embeddings so cosine distances are exact: "ML?" sits at
+# distance 0.2 from "What is ML?", "Cooking" is orthogonal to both
+_VECTORS = {
+    "What is ML?": [1.0, 0.0],
+    "ML?": [0.8, 0.6],
+    "Cooking": [0.0, 1.0],
+}
+_DISTANCE_ML = 0.2
+_SOURCES = [{"text": "ML Course - Lesson 1", "link": None}]
+
+# Near-duplicate course questions all embed well inside the default threshold,
+# as with a real sentence model; only the lesson number or course differs
+_LESSON_QUERY = "What is covered in lesson 1 of the MCP course?"
+_VECTORS.update(
+    {
+        _LESSON_QUERY: [1.0, 0.0],
+        "what is covered in lesson 1 of the MCP course": _at_distance(0.005),
+        "What is covered in lesson 2 of the MCP course?": _at_distance(0.01),
+        "What is covered in lesson 1 of the Chroma course?": _at_distance(0.02),
+    }
+)
+
+
+@pytest.fixture(scope="module")
+def embedding_function():
+    """Chroma embedding function mapping the known texts to fixed vectors."""
+    from chromadb.api.types import EmbeddingFunction
+
+    class _FixedEmbeddings(EmbeddingFunction):
+        def __init__(self):
+            pass
+
+        def __call__(self, input):
+            return [_VECTORS.get(text, [math.sqrt(0.5)] * 2) for text in input]
+
+    return _FixedEmbeddings()
+
+
+@pytest.fixture(scope="module")
+def chroma_client():
+    """In-memory Chroma client (one per process, so shared by the module)."""
+    import chromadb
+    from chromadb.config import Settings
+
+    return chromadb.EphemeralClient(Settings(anonymized_telemetry=False))
+
+
+@pytest.fixture
+def make_cache(chroma_client, embedding_function):
+    """Build SemanticCaches over the in-memory client, emptied after each test."""
+    from semantic_cache import SemanticCache
+
+    store = SimpleNamespace(client=chroma_client, embedding_function=embedding_function)
+
+    def _make(**kwargs):
+        return SemanticCache(store, **kwargs)
+
+    yield _make
+    chroma_client.delete_collection(SemanticCache.COLLECTION_NAME)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time source for last_used stamps."""
+    now = SimpleNamespace(value=0.0)
+    monkeypatch.setattr("semantic_cache.time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+class TestSemanticCacheLookup:
+    """Tests for hits and misses."""
+
+    def test_exact_query_hits(self, make_cache):
+        """Test that a stored query is answered with its answer and sources."""
+        cache = make_cache()
+        cache.store("What is ML?", "ML is a field of AI.", _SOURCES)
+
+        assert cache.lookup("What is ML?") == ("ML is a field of AI.", _SOURCES)
+
+    def test_empty_cache_misses(self, make_cache):
+        """Test that lookups on an empty cache miss."""
+        assert make_cache().lookup("What is ML?") is None
+
+    @pytest.mark.parametrize(
+        "threshold, hit",
+        [(_DISTANCE_ML + 1e-3, True), (_DISTANCE_ML - 1e-3, False)],
+        ids=["just_inside", "just_outside"],
+    )
+    def test_distance_threshold(self, make_cache, threshold, hit):
+        """Test that a similar query hits only within the distance threshold."""
+        cache = make_cache(distance_threshold=threshold)
+        cache.store("What is ML?", "ML is a field of AI.", _SOURCES)
+
+        result = cache.lookup("ML?")
+
+        assert (result is not None) is hit
+
+    def test_unrelated_query_misses(self, make_cache):
+        """Test that a dissimilar query misses."""
+        cache = make_cache()
+        cache.store("What is ML?", "ML is a field of AI.", _SOURCES)
+
+        assert cache.lookup("Cooking") is None
+
+    @pytest.mark.parametrize(
+        "query, hit",
+        [
+            ("what is covered in lesson 1 of the MCP course", True),
+            ("What is covered in lesson 2 of the MCP course?", False),
+            ("What is covered in lesson 1 of the Chroma course?", False),
+        ],
+        ids=["rephrased", "other_lesson", "other_course"],
+    )
+    def test_near_duplicate_queries(self, make_cache, query, hit):
+        """Test that close queries only hit when lesson and course match."""
+        cache = make_cache()
+        cache.store(_LESSON_QUERY, "Lesson 1 covers MCP architecture.", _SOURCES)
+
+        result = cache.lookup(query)
+
+        assert (result is not None) is hit
+
+    def test_other_version_misses(self, make_cache):
+        """Test that entries stored under another version are not served."""
+        make_cache(version="old").store("What is ML?", "Old answer", _SOURCES)
+
+        assert make_cache(version="new").lookup("What is ML?") is None
+        assert make_cache(version="old").lookup("What is ML?") is not None
+
+
+class TestSemanticCacheStore:
+    """Tests for what gets cached."""
+
+    @pytest.mark.parametrize("answer", ["", "  \n"], ids=["empty", "whitespace"])
+    def test_blank_answer_not_stored(self, make_cache, answer):
+        """Test that a blank answer is never cached."""
+        cache = make_cache()
+        cache.store("What is ML?", answer, _SOURCES)
+
+        assert cache.collection.count() == 0
+
+
+class TestSemanticCacheMaintenance:
+    """Tests for eviction and clearing."""
+
+    def test_evicts_least_recently_used(self, make_cache, clock):
+        """Test that eviction drops the entry with the oldest last_used."""
+        cache = make_cache(max_entries=2)
+        clock.value = 1.0
+        cache.store("What is ML?", "ML answer", [])
+        clock.value = 2.0
+        cache.store("Cooking", "Cooking answer", [])
+        clock.value = 3.0
+        assert cache.lookup("What is ML?") is not None  # Refreshes last_used
+
+        clock.value = 4.0
+        cache.store("ML?", "Short ML answer", [])
+
+        assert cache.collection.count() == 2
+        assert cache.lookup("Cooking") is None
+        assert cache.lookup("What is ML?") == ("ML answer", [])
+
+    def test_clear_removes_all_entries(self, make_cache):
+        """Test that clear() empties the cache and leaves it usable."""
+        cache = make_cache()
+        cache.store("What is ML?", "ML answer", [])
+
+        cache.clear()
+
+        assert cache.lookup("What is ML?") is None
+        cache.store("Cooking", "Cooking answer", [])
+        assert cache.lookup("Cooking") == ("Cooking answer", [])
@@ -102,7 +102,7 @@ async function sendMessage() {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 
     try {
-        const response = await fetch(`${API_URL}/query`, {
+        const response = await fetch(`${API_URL}/query/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -115,16 +115,33 @@ async function sendMessage() {
 
         if (!response.ok) throw new Error('Query failed');
 
-        const data = await response.json();
-        
-        // Update session ID if new
-        if (!currentSessionId) {
-            currentSessionId = data.session_id;
-        }
+        // Render answer chunks as they arrive (newline-delimited JSON events)
+        let answer = '';
+        let sources = null;
+        let streamingContent = null;
+        await readEventStream(response, event => {
+            if (event.type === 'session') {
+                // Update session ID if new
+                if (!currentSessionId) {
+                    currentSessionId = event.session_id;
+                }
+            } else if (event.type === 'text') {
+                answer += event.text;
+                if (!streamingContent) {
+                    streamingContent = loadingMessage.querySelector('.message-content');
+                }
+                streamingContent.innerHTML = marked.parse(answer);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event.type === 'sources') {
+                sources = event.sources;
+            } else if (event.type === 'error') {
+                throw new Error(event.detail);
+            }
+        });
 
-        // Replace loading message with response
+        // Replace streamed message with the complete response
         loadingMessage.remove();
-        addMessage(data.answer, 'assistant', data.sources);
+        addMessage(answer, 'assistant', sources);
 
     } catch (error) {
         // Replace loading message with error
@@ -190,6 +207,28 @@ function addMessage(content, type, sources = null, isWelcome = false) {
     return messageId;
 }
 
+// Read a newline-delimited JSON response, calling onEvent for each event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (line.trim()) onEvent(JSON.parse(line));
+        }
+
+        if (done) break;
+    }
+
+    if (buffer.trim()) onEvent(JSON.parse(buffer));
+}
+
 // Helper function to escape HTML for user messages
 function escapeHtml(text) {
     const div = document.createElement('div');